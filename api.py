@@ -5,25 +5,42 @@ move game logic to another file. Ideally the API will be simple, concerned
 primarily with communication to/from the API's users."""
 
 import sys
+from datetime import datetime, timedelta
 
 import endpoints
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
 from protorpc import remote, messages
-import re
 from models import StringMessage, NewGameForm, GameForm, MakeMoveForm, ScoreForms, GameForms, HistoryForms
+from models import MakeMovesForm, MoveResultForm, MovesForm
 
-from models import User, Game, Score, History
-from utils import get_by_urlsafe
+from models import User, Game, Score, StaleGameError
+from utils import get_by_urlsafe, key_from_urlsafe, fetch_page
+from engine import GameState, RESULTS, STATE_CHANGES
+import leaderboard
+from leaderboard_cache import GAMES_WON
+import averages
+import counters
+import game_cache
+import instrumentation
+import movelog
 
 sys.path.insert(0, 'libs')
 
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(urlsafe_game_key=messages.StringField(1), )
+POLL_GAME_REQUEST = endpoints.ResourceContainer(urlsafe_game_key=messages.StringField(1),
+                                                since_version=messages.IntegerField(2),
+                                                compact=messages.BooleanField(3))
 MAKE_MOVE_REQUEST = endpoints.ResourceContainer(MakeMoveForm, urlsafe_game_key=messages.StringField(1), )
+MAKE_MOVES_REQUEST = endpoints.ResourceContainer(MakeMovesForm, urlsafe_game_key=messages.StringField(1), )
 USER_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1), email=messages.StringField(2))
-MEMCACHE_MOVES_REMAINING = 'MOVES_REMAINING'
+PAGE_REQUEST = endpoints.ResourceContainer(limit=messages.IntegerField(1), cursor=messages.StringField(2))
+USER_PAGE_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1), limit=messages.IntegerField(2),
+                                                cursor=messages.StringField(3))
+GAME_PAGE_REQUEST = endpoints.ResourceContainer(urlsafe_game_key=messages.StringField(1),
+                                                limit=messages.IntegerField(2), cursor=messages.StringField(3))
 NUMBER_OF_RESULTS = 5
+# Every guess of make_moves adds a History entry to the same transaction.
+MAX_MOVES = 100
 
 
 @endpoints.api(name='hangman', version='v1')
@@ -37,11 +54,13 @@ class HangmanApi(remote.Service):
                       http_method='POST')
     def create_user(self, request):
         """Create a User. Requires a unique username"""
-        if User.query(User.name == request.user_name).get():
+        try:
+            user = User.create(request.user_name, request.email)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+        if not user:
             raise endpoints.ConflictException(
                 'A User with that name already exists!')
-        user = User(name=request.user_name, email=request.email)
-        user.put()
         return StringMessage(message='User {} created!'.format(
             request.user_name))
 
@@ -52,31 +71,40 @@ class HangmanApi(remote.Service):
                       http_method='POST')
     def new_game(self, request):
         """Creates new game"""
-        user = User.query(User.name == request.user_name).get()
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                 'A User with that name does not exist!')
+        difficulty = request.difficulty.name if request.difficulty else None
         try:
-            game = Game.new_game(user.key)
-        except ValueError:
-            raise endpoints.BadRequestException('Error while creating new game')
+            game = Game.new_game(user.key, difficulty, request.min_length, request.max_length, user.name)
+        except ValueError as e:
+            raise endpoints.BadRequestException('Error while creating new game: {}'.format(e))
 
         # Use a task queue to update the average attempts remaining.
         # This operation is not needed to complete the creation of a new game
         # so it is performed out of sequence.
-        taskqueue.add(url='/tasks/cache_average_attempts')
+        averages.schedule()
         return game.to_form('Good luck playing Hangman!')
 
-    @endpoints.method(request_message=GET_GAME_REQUEST,
+    @endpoints.method(request_message=POLL_GAME_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
     def get_game(self, request):
-        """Return the current game state."""
+        """Return the current game state. A game still at since_version is
+        answered with a not_modified reply, checked against the cached
+        version without decoding the game."""
+        if request.since_version is not None:
+            key = key_from_urlsafe(request.urlsafe_game_key)
+            if key.kind() == game_cache.KIND and game_cache.get_version(key) == request.since_version:
+                return self._not_modified(request)
         game = get_by_urlsafe(request.urlsafe_game_key, Game)
         if game:
-            return game.to_form('Time to make a move!')
+            if request.since_version is not None and (game.version or 0) == request.since_version:
+                return self._not_modified(request)
+            return game.to_form('Time to make a move!', compact=request.compact)
         else:
             raise endpoints.NotFoundException('Game not found!')
 
@@ -93,68 +121,76 @@ class HangmanApi(remote.Service):
         if game.game_canceled:
             return game.to_form('Game is already canceled!')
 
-        target_list = list(game.target)
+        attempts_before = game.attempts_remaining
+        state = GameState.from_game(game)
+        outcome = state.guess(request.guess)
+        state.apply_to(game)
 
-        if game.attempts_remaining < 1:
-            game.post_transaction(request.guess, "Your do not have any remaining", True, False)
-            game.end_game(True)
-            return game.to_form('You loose!')
+        _, message, game_over, won = RESULTS[outcome]
+        if movelog.enabled():
+            if not game_over:
+                try:
+                    movelog.append(game, request.guess)
+                except StaleGameError:
+                    raise endpoints.ConflictException('The game was changed by another move, please try again!')
+                return game.to_form(message)
+            movelog.flush(game.key)
 
-        if re.search('[a-zA-Z]', request.guess):
-            if len(request.guess) > 1:
-                if request.guess == game.target:
-                    game.post_transaction(request.guess, "You win!", True, False)
-                    game.end_game(True)
-                    for key, val in enumerate(target_list):
-                        game.progress[key] = val
-                    return game.to_form('You win!')
-                else:
-                    game.post_transaction(request.guess, "You loose!", True, False)
-                    game.end_game(False)
-                    for key, val in enumerate(target_list):
-                        game.progress[key] = val
-                    return game.to_form('You loose!')
-            if request.guess not in game.progress and request.guess not in game.letters_used:
-                if request.guess in target_list:
-                    for key, val in enumerate(target_list):
-                        if val == request.guess:
-                            game.progress[key] = request.guess
-                    if game.progress != target_list:
-                        game.post_transaction(request.guess, "Your guess is correct!", False, False)
-                        game.put()
-                        return game.to_form('Your guess is correct!')
-                    else:
-                        game.post_transaction(request.guess, "You win!", True, False)
-                        game.end_game(True)
-                        return game.to_form('You win!')
-                elif request.guess not in target_list:
-                    game.attempts_remaining -= 1
-                    if "_" in game.letters_used:
-                        _index = game.letters_used.index("_")
-                        game.letters_used[_index] = request.guess
-                    if game.attempts_remaining > 0:
-                        game.post_transaction(request.guess, "Your guess is not correct!", False, False)
-                        game.put()
-                        return game.to_form('Your guess is not correct!')
-                    else:
-                        game.post_transaction(request.guess, "You loose!", True, False)
-                        game.end_game(True)
-                        return game.to_form('You loose!')
-            else:
-                game.post_transaction(request.guess, "Already used!", False, False)
-                return game.to_form('Already used!')
+        history = game.new_history(request.guess, outcome)
+        if outcome in STATE_CHANGES:
+            self._save_moves(game, attempts_before, game_over, won, [history])
         else:
-            game.post_transaction(request.guess, "Please enter only alphabets!", False, False)
-            return game.to_form('Please enter only alphabets!')
+            history.put()
+        return game.to_form(message)
 
-    @endpoints.method(response_message=ScoreForms,
+    @endpoints.method(request_message=MAKE_MOVES_REQUEST,
+                      response_message=MovesForm,
+                      path='game/{urlsafe_game_key}/moves',
+                      name='make_moves',
+                      http_method='PUT')
+    def make_moves(self, request):
+        """Makes several moves in order and stops when the game ends. The game
+        and the history of all moves are saved in a single batch.
+        Returns a game state with the result of every applied guess"""
+        if len(request.guesses) > MAX_MOVES:
+            raise endpoints.BadRequestException('At most {} guesses can be made at once'.format(MAX_MOVES))
+        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        if game.game_over:
+            return MovesForm(game=game.to_form('Game already over!'))
+        if game.game_canceled:
+            return MovesForm(game=game.to_form('Game is already canceled!'))
+
+        attempts_before = game.attempts_remaining
+        state = GameState.from_game(game)
+        histories = []
+        results = []
+        message = 'Time to make a move!'
+        game_over = won = False
+        # History is ordered by date_time, so keep the guesses of the batch in order.
+        now = datetime.now()
+        for number, guess in enumerate(request.guesses):
+            outcome = state.guess(guess)
+            _, message, game_over, won = RESULTS[outcome]
+            histories.append(game.new_history(guess, outcome, now + timedelta(microseconds=number)))
+            results.append(MoveResultForm(guess=guess, message=message))
+            if game_over:
+                break
+        state.apply_to(game)
+
+        if movelog.enabled():
+            movelog.flush(game.key)
+        self._save_moves(game, attempts_before, game_over, won, histories)
+        return MovesForm(game=game.to_form(message), results=results)
+
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=ScoreForms,
                       path='scores',
                       name='get_scores',
                       http_method='GET')
     def get_scores(self, request):
-        """Return all scores"""
-        scores = Score.query()
-        return ScoreForms(items=[score.get_score() for score in scores])
+        """Return all scores, one page at a time"""
+        scores, next_cursor = fetch_page(Score.query(), request.limit, request.cursor)
+        return Score.to_forms(scores, next_cursor)
 
     @endpoints.method(request_message=USER_REQUEST,
                       response_message=ScoreForms,
@@ -163,12 +199,12 @@ class HangmanApi(remote.Service):
                       http_method='GET')
     def get_user_score(self, request):
         """Returns individual User's score"""
-        user = User.query(User.name == request.user_name).get()
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                 'A User with that name does not exist!')
-        scores = Score.query(Score.user == user.key)
-        return ScoreForms(items=[score.get_score() for score in scores])
+        score = Score.key_for(user.key).get()
+        return ScoreForms(items=[score.get_score()] if score else [])
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=GameForm,
@@ -185,19 +221,20 @@ class HangmanApi(remote.Service):
         else:
             return game.game_status("Game is in progress")
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_PAGE_REQUEST,
                       response_message=GameForms,
                       path='scores/user/{user_name}/games',
                       name='get_user_games',
                       http_method='GET')
     def get_user_games(self, request):
         """User Games"""
-        user = User.query(User.name == request.user_name).get()
+        user = User.get_by_name(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                 'A User with that name does not exist!')
         games = Game.query(Game.user == user.key, Game.game_canceled == False, Game.game_over == False)
-        return GameForms(items=[game.to_form('All Games') for game in games])
+        games, next_cursor = fetch_page(games, request.limit, request.cursor)
+        return Game.to_forms(games, 'All Games', next_cursor)
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=GameForm,
@@ -209,9 +246,15 @@ class HangmanApi(remote.Service):
         game = get_by_urlsafe(request.urlsafe_game_key, Game)
         if game.game_over:
             return game.game_status("Game already over")
+        if game.game_canceled:
+            return game.game_status("Game already cancelled")
         else:
-            game.post_transaction("", "Game Canceled", False, True)
-            game.cancel_the_game()
+            if movelog.enabled():
+                movelog.flush(game.key)
+            try:
+                game.cancel_the_game()
+            except StaleGameError:
+                raise endpoints.ConflictException('The game was changed by another move, please try again!')
             return game.game_status("Game Canceled")
 
     @endpoints.method(response_message=ScoreForms,
@@ -220,20 +263,19 @@ class HangmanApi(remote.Service):
                       http_method='GET')
     def get_high_scores(self, request):
         """High scores"""
-        scores = Score.query().order(-Score.games_won)
-        scores = scores.fetch(NUMBER_OF_RESULTS)
-        return ScoreForms(items=[score.get_score() for score in scores])
+        rows = leaderboard.get_board(GAMES_WON)[:NUMBER_OF_RESULTS]
+        return ScoreForms(items=[leaderboard.to_score_form(row) for row in rows])
 
-    @endpoints.method(response_message=ScoreForms,
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=ScoreForms,
                       path='scores/rankings',
                       name='get_user_rankings',
                       http_method='GET')
     def get_user_rankings(self, request):
-        """User Rankings by accuracy"""
-        scores = Score.query().order(-Score.accuracy)
-        return ScoreForms(items=[score.get_ranking() for score in scores])
+        """User Rankings by accuracy, one page at a time"""
+        return leaderboard.get_rankings_page(request.limit, request.cursor)
 
-    @endpoints.method(request_message=GET_GAME_REQUEST,
+    @endpoints.method(request_message=GAME_PAGE_REQUEST,
                       response_message=HistoryForms,
                       path='games/{urlsafe_game_key}/history',
                       name='get_game_history',
@@ -241,20 +283,33 @@ class HangmanApi(remote.Service):
     def get_game_history(self, request):
         """Game History"""
         game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        history = History.query(History.game == game.key).order(-History.date_time)
-        return HistoryForms(items=[transaction.get_history() for transaction in history])
+        if movelog.enabled():
+            movelog.flush(game.key)
+        history, next_cursor = fetch_page(game.get_history_query(), request.limit, request.cursor)
+        return HistoryForms(items=[transaction.get_history() for transaction in history], next_cursor=next_cursor)
 
     @staticmethod
-    def _cache_average_attempts():
-        """Populates memcache with the average moves remaining of Games"""
-        games = Game.query(Game.game_over == False, Game.game_canceled == False).fetch()
-        if games:
-            count = len(games)
-            total_attempts_remaining = sum([game.attempts_remaining
-                                            for game in games])
-            average = float(total_attempts_remaining) / count
-            memcache.set(MEMCACHE_MOVES_REMAINING,
-                         'The average moves remaining is {:.2f}'.format(average))
+    def _not_modified(request):
+        """Returns the GameForm telling that a game is still at since_version"""
+        return GameForm(urlsafe_key=request.urlsafe_game_key, version=request.since_version, not_modified=True)
+
+    @staticmethod
+    def _save_moves(game, attempts_before, game_over, won, histories):
+        """Saves the histories of moves together with the changed game, then
+        adjusts the active games counters. If game_over, the game is ended and
+        the user's Score is updated in the same transaction, then the
+        leaderboards get the new Score.
+        Raises:
+            endpoints.ConflictException: if another move saved the game first"""
+        game.game_over = game_over
+        try:
+            score = game.save(histories, won=won if game_over else None)
+        except StaleGameError:
+            raise endpoints.ConflictException('The game was changed by another move, please try again!')
+        counted = counters.adjust_for_move_async(attempts_before, game.attempts_remaining, game_over)
+        if score is not None:
+            leaderboard.update(score)
+        counted.get_result()
 
 
-api = endpoints.api_server([HangmanApi])
+api = instrumentation.instrument(endpoints.api_server([HangmanApi]))
@@ -0,0 +1,47 @@
+"""averages.py - The average attempts remaining of the active games, kept in
+memcache by a debounced task. Kept apart from api.py so the task handler does
+not import the endpoints service."""
+
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+import counters
+
+MEMCACHE_MOVES_REMAINING = 'MOVES_REMAINING'
+MEMCACHE_AVERAGE_PENDING = 'AVERAGE_ATTEMPTS_PENDING'
+MEMCACHE_AVERAGE_ENQUEUED = 'AVERAGE_ATTEMPTS_ENQUEUED'
+MEMCACHE_AVERAGE_SUPPRESSED = 'AVERAGE_ATTEMPTS_SUPPRESSED'
+AVERAGE_ATTEMPTS_WINDOW = 10
+
+
+def schedule():
+    """Enqueues a task to update the average moves remaining, at most one
+    per AVERAGE_ATTEMPTS_WINDOW seconds. A memcache flag suppresses most
+    repeats cheaply and the task name, taken from the time window,
+    suppresses the rest. The task runs at the end of the window so it
+    includes every game created in it.
+    Returns:
+        True if a task was enqueued"""
+    if memcache.add(MEMCACHE_AVERAGE_PENDING, True, time=AVERAGE_ATTEMPTS_WINDOW):
+        window = int(time.time()) // AVERAGE_ATTEMPTS_WINDOW
+        try:
+            taskqueue.add(url='/tasks/cache_average_attempts',
+                          name='cache-average-attempts-{}'.format(window),
+                          countdown=AVERAGE_ATTEMPTS_WINDOW)
+            memcache.incr(MEMCACHE_AVERAGE_ENQUEUED, initial_value=0)
+            return True
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+    memcache.incr(MEMCACHE_AVERAGE_SUPPRESSED, initial_value=0)
+    return False
+
+
+def cache_average_attempts():
+    """Populates memcache with the average moves remaining of Games"""
+    count, total_attempts_remaining = counters.get_totals()
+    if count > 0:
+        average = float(total_attempts_remaining) / count
+        memcache.set(MEMCACHE_MOVES_REMAINING,
+                     'The average moves remaining is {:.2f}'.format(average))
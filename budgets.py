@@ -0,0 +1,78 @@
+"""budgets.py - Attempt budgets of the target words, calibrated offline by
+tools/simulate.py from games played by a letter-frequency solver.
+
+The budgets file holds one record per word of the noun pool, in pool order,
+behind a header with the word count and a checksum of the words, so a file
+built from another corpus is ignored. Words without a budget fall back to one
+attempt per letter."""
+
+import logging
+import os
+import struct
+import threading
+import zlib
+
+from random_words import get_word_pool
+
+BUDGETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'attempt_budgets.bin')
+MAGIC = b'HAB1'
+HEADER = struct.Struct('<4sII')
+# mean guesses * 100, mean misses * 100, 90th percentile misses, most misses, budget
+RECORD = struct.Struct('<HHBBB')
+
+_budgets = None
+_budgets_lock = threading.Lock()
+
+
+def checksum(words):
+    """Returns the checksum of a word list stored in the header"""
+    return zlib.crc32(u'\n'.join(words).encode('utf-8')) & 0xffffffff
+
+
+def dumps(words, records):
+    """Returns the budgets file of words, records being (mean guesses, mean
+    misses, 90th percentile misses, most misses, budget) per word"""
+    parts = [HEADER.pack(MAGIC, len(words), checksum(words))]
+    for mean_guesses, mean_misses, p90_misses, most_misses, budget in records:
+        parts.append(RECORD.pack(min(int(round(mean_guesses * 100)), 0xffff),
+                                 min(int(round(mean_misses * 100)), 0xffff),
+                                 min(p90_misses, 255), min(most_misses, 255), min(max(budget, 1), 255)))
+    return b''.join(parts)
+
+
+def load_budgets(path, words):
+    """Returns dict of word -> attempt budget read from the budgets file at
+    path, or an empty dict if it is missing or was built from other words"""
+    try:
+        with open(path, 'rb') as budgets_file:
+            data = budgets_file.read()
+    except IOError:
+        return {}
+    if len(data) < HEADER.size:
+        logging.warning('Ignoring truncated budgets file %s', path)
+        return {}
+    magic, count, words_checksum = HEADER.unpack_from(data)
+    if (magic != MAGIC or count != len(words) or words_checksum != checksum(words)
+            or len(data) != HEADER.size + count * RECORD.size):
+        logging.warning('Ignoring budgets file %s built from another word list', path)
+        return {}
+    budgets = {}
+    for number, word in enumerate(words):
+        budgets[word] = RECORD.unpack_from(data, HEADER.size + number * RECORD.size)[4]
+    return budgets
+
+
+def get_budgets():
+    """Returns the process-wide dict of word -> attempt budget, loading it
+    on first use"""
+    global _budgets
+    if _budgets is None:
+        with _budgets_lock:
+            if _budgets is None:
+                _budgets = load_budgets(BUDGETS_FILE, get_word_pool().words)
+    return _budgets
+
+
+def get_attempt_budget(word):
+    """Returns the attempts allowed for a target word"""
+    return get_budgets().get(word, len(word))
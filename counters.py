@@ -0,0 +1,75 @@
+"""counters.py - Sharded counters of the active games and of the attempts
+remaining in them. They are adjusted whenever a game starts, loses an attempt,
+ends or is canceled, so the average attempts remaining is read from
+NUM_SHARDS entities instead of scanning every active game."""
+
+import random
+
+from google.appengine.ext import ndb
+
+NUM_SHARDS = 20
+
+
+class ActiveGamesShard(ndb.Model):
+    """One shard of the active games counters"""
+    games = ndb.IntegerProperty(default=0, indexed=False)
+    attempts_remaining = ndb.IntegerProperty(default=0, indexed=False)
+
+
+def _shard_key(number):
+    return ndb.Key(ActiveGamesShard, 'shard-{}'.format(number))
+
+
+def adjust_async(games, attempts_remaining):
+    """Adds to the counters of a random shard in a transaction.
+    Args:
+        games: The change of the number of active games
+        attempts_remaining: The change of the total attempts remaining
+    Returns:
+        A Future that completes when the shard is saved"""
+    if not games and not attempts_remaining:
+        future = ndb.Future()
+        future.set_result(None)
+        return future
+
+    key = _shard_key(random.randrange(NUM_SHARDS))
+
+    @ndb.transactional_tasklet
+    def adjust():
+        shard = yield key.get_async()
+        if shard is None:
+            shard = ActiveGamesShard(key=key)
+        shard.games += games
+        shard.attempts_remaining += attempts_remaining
+        yield shard.put_async()
+
+    return adjust()
+
+
+def adjust_for_move_async(attempts_before, attempts_after, ended):
+    """Adjusts the counters for a move of an active game.
+    Args:
+        attempts_before: The attempts remaining before the move
+        attempts_after: The attempts remaining after the move
+        ended: True if the move ended the game
+    Returns:
+        A Future that completes when the counters are saved"""
+    if ended:
+        return adjust_async(-1, -attempts_before)
+    return adjust_async(0, attempts_after - attempts_before)
+
+
+def get_totals():
+    """Returns the number of active games and their total attempts remaining"""
+    shards = ndb.get_multi([_shard_key(number) for number in range(NUM_SHARDS)])
+    games = sum(shard.games for shard in shards if shard)
+    attempts_remaining = sum(shard.attempts_remaining for shard in shards if shard)
+    return games, attempts_remaining
+
+
+def set_totals(games, attempts_remaining):
+    """Replaces the counters with totals counted from the games"""
+    shards = [ActiveGamesShard(key=_shard_key(number)) for number in range(NUM_SHARDS)]
+    shards[0].games = games
+    shards[0].attempts_remaining = attempts_remaining
+    ndb.put_multi(shards)
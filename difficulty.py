@@ -0,0 +1,109 @@
+"""difficulty.py - Precomputed index over the noun corpus used to pick the
+target word of a new game by difficulty and/or word length in O(1)."""
+
+import threading
+from array import array
+from random import randrange
+
+from random_words import get_word_pool
+
+EASY = 'EASY'
+MEDIUM = 'MEDIUM'
+HARD = 'HARD'
+TIERS = (EASY, MEDIUM, HARD)
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+RARITY_SCALE = 1000
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class WordIndex(object):
+    """Compact arrays describing every word of a word pool.
+
+    For every word the index stores its length, its number of distinct
+    letters and a letter-rarity score (0 for the most common letters up to
+    RARITY_SCALE). Words are ranked by rarity * distinct / length, since
+    repeated letters make a word easier and rare letters make it harder, and
+    split into three equally sized tiers.
+
+    Each tier (and None for all words) keeps the word positions sorted by
+    length plus a table of where every length starts, so any difficulty and
+    length range is a contiguous slice and a pick is one randrange."""
+    __slots__ = ('words', 'lengths', 'distinct', 'rarity', 'orders')
+
+    def __init__(self, words):
+        self.words = words
+        self.lengths = array('B', (min(len(word), 255) for word in words))
+        self.distinct = array('B')
+        self.rarity = array('H')
+
+        containing = dict((letter, 0) for letter in LETTERS)
+        letter_sets = []
+        for word in words:
+            letters = set(word.lower()).intersection(LETTERS)
+            letter_sets.append(letters)
+            for letter in letters:
+                containing[letter] += 1
+        most_common = max(containing.values()) or 1
+
+        for letters in letter_sets:
+            self.distinct.append(min(len(letters), 255))
+            if letters:
+                rarity = sum(RARITY_SCALE - RARITY_SCALE * containing[letter] // most_common
+                             for letter in letters) // len(letters)
+            else:
+                rarity = 0
+            self.rarity.append(rarity)
+
+        ranked = sorted(range(len(words)), key=self.score)
+        tier_size = -(-len(ranked) // len(TIERS))
+        self.orders = {None: self._by_length(ranked)}
+        for number, tier in enumerate(TIERS):
+            self.orders[tier] = self._by_length(ranked[number * tier_size:(number + 1) * tier_size])
+
+    def score(self, position):
+        """Returns difficulty score of word at position"""
+        return float(self.rarity[position]) * self.distinct[position] / (self.lengths[position] or 1)
+
+    def _by_length(self, positions):
+        """Returns positions sorted by word length and the start of every
+        length in that order"""
+        lengths = self.lengths
+        order = array('I', sorted(positions, key=lengths.__getitem__))
+        counts = [0] * 256
+        for position in order:
+            counts[lengths[position]] += 1
+        starts = array('I', [0] * 257)
+        for length in range(256):
+            starts[length + 1] = starts[length] + counts[length]
+        return order, starts
+
+    def choose(self, difficulty=None, min_length=None, max_length=None):
+        """Returns a random word of the difficulty tier with a length between
+        min_length and max_length (both inclusive)
+        Raises:
+            ValueError: for an unknown tier or when no word matches"""
+        if difficulty not in self.orders:
+            raise ValueError('Unknown difficulty {}'.format(difficulty))
+        order, starts = self.orders[difficulty]
+        low = max(min_length or 0, 0)
+        high = min(255 if max_length is None else max_length, 255)
+        if low > high:
+            raise ValueError('No words between {} and {} letters'.format(min_length, max_length))
+        start, end = starts[low], starts[high + 1]
+        if start >= end:
+            raise ValueError('No words between {} and {} letters'.format(min_length, max_length))
+        return self.words[order[randrange(start, end)]]
+
+
+def get_word_index():
+    """Returns the process-wide WordIndex over the noun pool, building it on
+    first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = WordIndex(get_word_pool().words)
+    return _index
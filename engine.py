@@ -0,0 +1,125 @@
+"""engine.py - Rules of Hangman without any datastore dependency.
+
+A GameState keeps a game as bitmasks: for every letter of the target the
+positions it occupies, the positions revealed so far and the letters already
+guessed. Evaluating a guess is therefore O(1) apart from writing the revealed
+letters into progress. HangmanApi.make_move loads a GameState from a Game,
+applies the guess and copies the state back."""
+
+import re
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+LETTER_BITS = dict((letter, 1 << number) for number, letter in enumerate(LETTERS))
+BLANK = '_'
+
+# Outcomes of a guess
+CORRECT = 1
+WRONG = 2
+WON = 3
+LOST = 4
+ALREADY_USED = 5
+INVALID = 6
+NO_ATTEMPTS = 7
+# Not a guess: recorded in the history when a game is canceled
+CANCELED = 8
+
+# Outcome -> (history result, response message, game over, won)
+RESULTS = {
+    CORRECT: ('Your guess is correct!', 'Your guess is correct!', False, False),
+    WRONG: ('Your guess is not correct!', 'Your guess is not correct!', False, False),
+    WON: ('You win!', 'You win!', True, True),
+    LOST: ('You loose!', 'You loose!', True, False),
+    ALREADY_USED: ('Already used!', 'Already used!', False, False),
+    INVALID: ('Please enter only alphabets!', 'Please enter only alphabets!', False, False),
+    NO_ATTEMPTS: ('Your do not have any remaining', 'You loose!', True, False),
+    CANCELED: ('Game Canceled', 'Game Canceled', False, False),
+}
+
+# Outcomes that change the state of the game
+STATE_CHANGES = frozenset([CORRECT, WRONG, WON, LOST, NO_ATTEMPTS])
+
+_HAS_LETTER = re.compile('[a-zA-Z]')
+_POSITIONS_CACHE_SIZE = 4096
+_positions_cache = {}
+
+
+def letter_positions(target):
+    """Returns dict of letter -> bitmask of the positions of the letter in
+    target. Results are cached as targets repeat across games."""
+    positions = _positions_cache.get(target)
+    if positions is None:
+        positions = {}
+        for position, letter in enumerate(target):
+            positions[letter] = positions.get(letter, 0) | (1 << position)
+        if len(_positions_cache) >= _POSITIONS_CACHE_SIZE:
+            _positions_cache.clear()
+        _positions_cache[target] = positions
+    return positions
+
+
+class GameState(object):
+    """State of one game of Hangman"""
+    __slots__ = ('target', 'positions', 'complete', 'revealed', 'used',
+                 'progress', 'letters_used', 'attempts_remaining')
+
+    def __init__(self, target, progress, letters_used, attempts_remaining):
+        self.target = target
+        self.positions = letter_positions(target)
+        self.complete = (1 << len(target)) - 1
+        self.progress = list(progress)
+        self.letters_used = list(letters_used)
+        self.attempts_remaining = attempts_remaining
+        self.revealed = 0
+        self.used = 0
+        for position, letter in enumerate(self.progress):
+            if letter != BLANK:
+                self.revealed |= 1 << position
+                self.used |= LETTER_BITS.get(letter, 0)
+        for letter in self.letters_used:
+            self.used |= LETTER_BITS.get(letter, 0)
+
+    @classmethod
+    def from_game(cls, game):
+        """Returns GameState of a Game"""
+        return cls(game.target, game.progress, game.letters_used, game.attempts_remaining)
+
+    def apply_to(self, game):
+        """Copies the state onto a Game"""
+        game.progress = list(self.progress)
+        game.letters_used = list(self.letters_used)
+        game.attempts_remaining = self.attempts_remaining
+
+    def guess(self, guess):
+        """Applies a guess of a single letter or of the whole word.
+        Guesses are case insensitive.
+        Returns:
+            The outcome of the guess"""
+        if self.attempts_remaining < 1:
+            return NO_ATTEMPTS
+        if not _HAS_LETTER.search(guess):
+            return INVALID
+        guess = guess.lower()
+
+        if len(guess) > 1:
+            self.progress = list(self.target)
+            self.revealed = self.complete
+            return WON if guess == self.target else LOST
+
+        bit = LETTER_BITS[guess]
+        if self.used & bit:
+            return ALREADY_USED
+        self.used |= bit
+
+        mask = self.positions.get(guess, 0)
+        if mask:
+            self.revealed |= mask
+            while mask:
+                lowest = mask & -mask
+                self.progress[lowest.bit_length() - 1] = guess
+                mask ^= lowest
+            return WON if self.revealed == self.complete else CORRECT
+
+        self.attempts_remaining -= 1
+        if BLANK in self.letters_used:
+            self.letters_used[self.letters_used.index(BLANK)] = guess
+        return WRONG if self.attempts_remaining > 0 else LOST
@@ -0,0 +1,121 @@
+"""export.py - Bulk export of Users, Games, Scores and History as NDJSON,
+one JSON object per entity and line, for analytics.
+
+Entities are read in batches with query cursors and turned into lines one
+batch at a time. An export can be read directly, one batch per request
+ending with a line that holds the cursor to resume from, or run by chained
+tasks that store every batch as a compressed ExportChunk, downloaded one
+chunk per request. App Engine buffers whole responses, so every response
+stays the size of one batch however large the export."""
+
+import json
+from datetime import date, datetime
+
+from google.appengine.ext import ndb
+
+from models import User, Game, Score, History
+
+KINDS = (User, Game, Score, History)
+BATCH_SIZE = 500
+
+
+class Export(ndb.Model):
+    """An export run by tasks. Its ExportChunks are its children, numbered
+    from 1 in the order of the lines."""
+    kinds = ndb.StringProperty(repeated=True, indexed=False)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    chunks = ndb.IntegerProperty(default=0, indexed=False)
+    entities = ndb.IntegerProperty(default=0, indexed=False)
+    done = ndb.BooleanProperty(default=False, indexed=False)
+
+
+class ExportChunk(ndb.Model):
+    """One batch of NDJSON lines of an Export"""
+    lines = ndb.BlobProperty(compressed=True)
+
+
+def get_kind(name):
+    """Returns the model class of an exported kind name
+    Raises:
+        ValueError: for a kind that is not exported"""
+    for model in KINDS:
+        if model._get_kind() == name:
+            return model
+    raise ValueError('Unknown kind {}'.format(name))
+
+
+def to_line(entity):
+    """Returns the NDJSON line of an entity, with its kind and urlsafe key"""
+    record = entity.to_dict()
+    record['_kind'] = entity._get_kind()
+    record['_key'] = entity.key.urlsafe()
+    return json.dumps(record, default=_encode, sort_keys=True) + '\n'
+
+
+def _encode(value):
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError('Cannot export {!r}'.format(value))
+
+
+def fetch_batch(model, cursor=None, batch_size=BATCH_SIZE):
+    """Returns the lines of one batch of entities of a kind and the Cursor of
+    the next batch or None"""
+    entities, next_cursor, more = model.query().fetch_page(batch_size, start_cursor=cursor)
+    return ''.join(to_line(entity) for entity in entities), next_cursor if more else None
+
+
+def get_batch(model, cursor=None):
+    """Returns the lines of one batch of entities of a kind, followed by a
+    line with the next_cursor to resume from if there are more entities"""
+    lines, next_cursor = fetch_batch(model, cursor)
+    if next_cursor is not None:
+        lines += json.dumps({'next_cursor': next_cursor.urlsafe()}) + '\n'
+    return lines
+
+
+def start(kinds):
+    """Creates an Export of kinds, given by name
+    Returns:
+        The key of the Export"""
+    for name in kinds:
+        get_kind(name)
+    return Export(kinds=list(kinds)).put()
+
+
+def export_batch(export_key, number, kind, cursor=None):
+    """Stores a batch of an Export as its ExportChunk number. Storing the
+    same number again replaces the chunk, so a retried task does not add
+    lines twice.
+    Args:
+        export_key: The key of the Export
+        number: The number of the chunk, from 1
+        kind: The name of the kind being exported
+        cursor: The Cursor of the batch or None for the first batch of kind
+    Returns:
+        The kind and Cursor of the next batch, or (None, None) when the
+        export is done"""
+    export = export_key.get()
+    lines, next_cursor = fetch_batch(get_kind(kind), cursor)
+    if number > export.chunks:
+        export.chunks = number
+        export.entities += lines.count('\n')
+    next_kind = kind
+    if next_cursor is None:
+        position = export.kinds.index(kind)
+        next_kind = export.kinds[position + 1] if position + 1 < len(export.kinds) else None
+        export.done = next_kind is None
+    ndb.put_multi([ExportChunk(parent=export_key, id=number, lines=lines), export])
+    return next_kind, next_cursor
+
+
+def get_chunk(export, number):
+    """Returns the lines of the ExportChunk number of an Export, followed by
+    a line with the next_chunk to download if it is not the last chunk"""
+    chunk = ndb.Key(ExportChunk, number, parent=export.key).get()
+    lines = chunk.lines if chunk is not None else ''
+    if number < export.chunks:
+        lines += json.dumps({'next_chunk': number + 1}) + '\n'
+    return lines
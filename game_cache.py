@@ -0,0 +1,64 @@
+"""game_cache.py - Write-through cache of Game entities in memcache.
+
+Every saved Game carries a version that is increased on each save. The cache
+only ever moves forward: a write replaces the cached Game with compare-and-set
+and is skipped when the cache already holds the same or a newer version, so a
+slow request cannot put back an older state of the game."""
+
+from google.appengine.api import memcache
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import ndb
+
+KIND = 'Game'
+MEMCACHE_GAME = 'GAME_{}'
+CACHE_SECONDS = 60 * 60
+CAS_RETRIES = 3
+
+
+class StaleGameError(Exception):
+    """Raised when a Game was saved by another request since it was read"""
+
+
+def get(key, load=None):
+    """Returns the Game of a key from the cache, reading it with load(key),
+    or from the datastore, and caching it on a miss, or None if it does not
+    exist"""
+    cached = memcache.get(MEMCACHE_GAME.format(key.urlsafe()))
+    if cached is not None:
+        return ndb.model_from_protobuf(entity_pb.EntityProto(cached[1]))
+    game = load(key) if load else key.get()
+    if game is not None:
+        store(game)
+    return game
+
+
+def get_version(key):
+    """Returns the version of the cached Game of a key without decoding it,
+    or None if it is not cached"""
+    cached = memcache.get(MEMCACHE_GAME.format(key.urlsafe()))
+    return cached[0] if cached is not None else None
+
+
+def store(game):
+    """Writes a saved Game to the cache unless the cache holds the same or a
+    newer version"""
+    name = MEMCACHE_GAME.format(game.key.urlsafe())
+    version = game.version or 0
+    value = (version, ndb.model_to_protobuf(game).Encode())
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        cached = client.gets(name)
+        if cached is None:
+            if client.add(name, value, time=CACHE_SECONDS):
+                return
+        elif cached[0] >= version:
+            return
+        elif client.cas(name, value, time=CACHE_SECONDS):
+            return
+    # Give up on a contended entry rather than risk leaving it stale.
+    client.delete(name)
+
+
+def delete_multi(keys):
+    """Drops Games from the cache"""
+    memcache.delete_multi([MEMCACHE_GAME.format(key.urlsafe()) for key in keys])
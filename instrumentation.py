@@ -0,0 +1,134 @@
+"""instrumentation.py - Per-request accounting of wall time and API calls.
+
+instrument() wraps a WSGI app. Each request it serves has its datastore,
+memcache and taskqueue calls counted by an apiproxy hook, and is written to
+the log as one JSON line when it finishes. The requests also go into rolling
+per-endpoint histograms kept in memory by each instance, which the admin
+stats handler in main.py returns."""
+
+import bisect
+import json
+import logging
+import threading
+import time
+from collections import Counter
+
+from google.appengine.api import apiproxy_stub_map
+
+COUNTED_SERVICES = frozenset(['datastore_v3', 'memcache', 'taskqueue'])
+# Upper bounds of the latency buckets in milliseconds; the last is unbounded.
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+WINDOW_MINUTES = 10
+
+_local = threading.local()
+_lock = threading.Lock()
+# Endpoint name -> minute -> stats of the requests served in that minute.
+_stats = {}
+
+
+def _count_call(service, call, request, response):
+    calls = getattr(_local, 'calls', None)
+    if calls is not None and service in COUNTED_SERVICES:
+        calls['{}.{}'.format(service, call)] += 1
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('instrumentation', _count_call)
+
+
+def instrument(app):
+    """Returns a WSGI app that records every request served by app"""
+
+    def instrumented(environ, start_response):
+        name = environ.get('PATH_INFO', '')
+        status = []
+
+        def record_status(response_status, headers, exc_info=None):
+            status.append(int(response_status.split(' ', 1)[0]))
+            return start_response(response_status, headers, exc_info)
+
+        _local.calls = Counter()
+        start = time.time()
+        try:
+            body = app(environ, record_status)
+        except Exception:
+            _finish(name, start, 500)
+            raise
+        if isinstance(body, list):
+            _finish(name, start, status[0] if status else 500)
+            return body
+        # Streamed responses are still running until the body is consumed.
+        return _StreamedBody(body, lambda: _finish(name, start, status[0] if status else 500))
+
+    return instrumented
+
+
+class _StreamedBody(object):
+    """Iterates a response body and finishes the request record on close"""
+
+    def __init__(self, body, finish):
+        self.body = body
+        self.finish = finish
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.finish()
+
+
+def _finish(name, start, status):
+    """Logs a finished request and adds it to the histograms"""
+    milliseconds = (time.time() - start) * 1000
+    calls = getattr(_local, 'calls', None) or Counter()
+    _local.calls = None
+    logging.info('request_stats %s', json.dumps({'endpoint': name, 'status': status,
+                                                 'ms': round(milliseconds, 1), 'calls': calls},
+                                                sort_keys=True))
+
+    minute = int(start // 60)
+    with _lock:
+        minutes = _stats.setdefault(name, {})
+        stats = minutes.get(minute)
+        if stats is None:
+            stats = minutes[minute] = {'requests': 0, 'errors': 0, 'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                                       'calls': Counter()}
+            for old in [old for old in minutes if old <= minute - WINDOW_MINUTES]:
+                del minutes[old]
+        stats['requests'] += 1
+        if status >= 500:
+            stats['errors'] += 1
+        stats['buckets'][bisect.bisect_left(LATENCY_BUCKETS_MS, milliseconds)] += 1
+        stats['calls'].update(calls)
+
+
+def get_stats():
+    """Returns the requests of every endpoint served by this instance in the
+    last WINDOW_MINUTES minutes, with a histogram of their latency and their
+    API calls per request."""
+    first = int(time.time() // 60) - WINDOW_MINUTES + 1
+    result = {}
+    with _lock:
+        for name, minutes in _stats.items():
+            requests = errors = 0
+            buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+            calls = Counter()
+            for minute, stats in minutes.items():
+                if minute < first:
+                    continue
+                requests += stats['requests']
+                errors += stats['errors']
+                buckets = [total + count for total, count in zip(buckets, stats['buckets'])]
+                calls.update(stats['calls'])
+            if not requests:
+                continue
+            bounds = [str(bound) for bound in LATENCY_BUCKETS_MS] + ['inf']
+            result[name] = {'requests': requests,
+                            'errors': errors,
+                            'latency_ms': [[bound, count] for bound, count in zip(bounds, buckets)],
+                            'calls_per_request': dict((call, round(count / float(requests), 2))
+                                                      for call, count in calls.items())}
+    return result
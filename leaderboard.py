@@ -0,0 +1,161 @@
+"""leaderboard.py - Precomputed leaderboards of the best Scores, stored in
+memcache with user names already resolved so that the high score and ranking
+endpoints are served with a single cache read. A board is rebuilt from the
+datastore when it is missing from memcache or older than BOARD_SECONDS, and
+updated in place when a finished game changes a Score."""
+
+import time
+
+from google.appengine.api import memcache
+
+import endpoints
+
+from leaderboard_cache import MEMCACHE_LEADERBOARD, ACCURACY, BOARDS
+from models import Score, ScoreForm, ScoreForms, get_user_names, user_name_of
+from utils import fetch_page, page_size
+
+LEADERBOARD_SIZE = 100
+CAS_RETRIES = 3
+# Boards are built from an eventually consistent query, so they are rebuilt
+# this long after they were built to pick up Scores the query did not see
+# yet. Updates do not make a board younger.
+BOARD_SECONDS = 5 * 60
+# Cursors of pages served from a board are this prefix and the row offset.
+BOARD_CURSOR = 'board:'
+
+
+def get_board(order):
+    """Returns the rows of the leaderboard ordered by a Score property, at
+    most LEADERBOARD_SIZE, building it from the datastore if it is not
+    cached or has expired."""
+    key = MEMCACHE_LEADERBOARD.format(order)
+    board = memcache.get(key)
+    if board is not None and not _expired(board):
+        return board['rows']
+    rows = _build(order)
+    board_value = {'built_at': time.time(), 'rows': rows}
+    if board is None:
+        memcache.add(key, board_value, time=BOARD_SECONDS)
+    else:
+        memcache.set(key, board_value, time=BOARD_SECONDS)
+    return rows
+
+
+def get_rankings_page(limit, cursor):
+    """Returns ScoreForms with one page of rankings by accuracy. Pages within
+    the board are served from the cache. The last of them hands out a
+    datastore cursor positioned after the board, and later pages are read
+    from the datastore with its cursors.
+    Raises:
+        endpoints.BadRequestException: for an invalid limit or cursor"""
+    query = Score.query().order(-Score.accuracy)
+    if cursor and not cursor.startswith(BOARD_CURSOR):
+        scores, next_cursor = fetch_page(query, limit, cursor)
+        return Score.to_forms(scores, next_cursor, ranking=True)
+
+    limit = page_size(limit)
+    try:
+        offset = int(cursor[len(BOARD_CURSOR):]) if cursor else 0
+    except ValueError:
+        raise endpoints.BadRequestException('Invalid cursor')
+    rows = get_board(ACCURACY)
+    full = len(rows) >= LEADERBOARD_SIZE
+    if offset < len(rows):
+        end = min(offset + limit, len(rows))
+        if end < len(rows):
+            next_cursor = BOARD_CURSOR + str(end)
+        else:
+            next_cursor = _board_end_cursor(query) if full else None
+        return ScoreForms(items=[to_ranking_form(row) for row in rows[offset:end]], next_cursor=next_cursor)
+    # A board cursor past the end of a board that has since been rebuilt.
+    end_cursor = _board_end_cursor(query) if full else None
+    if end_cursor is None:
+        return ScoreForms(items=[])
+    scores, next_cursor = fetch_page(query, limit, end_cursor)
+    return Score.to_forms(scores, next_cursor, ranking=True)
+
+
+def _board_end_cursor(query):
+    """Returns the urlsafe datastore cursor after the first LEADERBOARD_SIZE
+    results of query, found with a keys-only read"""
+    _, cursor, more = query.fetch_page(LEADERBOARD_SIZE, keys_only=True)
+    return cursor.urlsafe() if more and cursor else None
+
+
+def update(score):
+    """Updates every cached leaderboard with a changed Score. A board is
+    dropped, and rebuilt on its next read, when the change could let a Score
+    that is not on the board move onto it."""
+    row = _row(score, user_name_of(score))
+    client = memcache.Client()
+    for order in BOARDS:
+        key = MEMCACHE_LEADERBOARD.format(order)
+        for _ in range(CAS_RETRIES):
+            board = client.gets(key)
+            if board is None:
+                break
+            if _expired(board):
+                client.delete(key)
+                break
+            rows = board['rows']
+            updated = _updated(rows, row, order)
+            if updated is rows:
+                break
+            if updated is None:
+                client.delete(key)
+                break
+            # The board keeps the expiry it was built with.
+            remaining = int(board['built_at'] + BOARD_SECONDS - time.time()) + 1
+            if client.cas(key, {'built_at': board['built_at'], 'rows': updated}, time=remaining):
+                break
+        else:
+            client.delete(key)
+
+
+def to_score_form(row):
+    """Returns the ScoreForm of a leaderboard row"""
+    return ScoreForm(user_name=row['user_name'], games_played=row['games_played'], games_won=row['games_won'],
+                     accuracy=row['accuracy'], score=row['score'])
+
+
+def to_ranking_form(row):
+    """Returns the ranking ScoreForm of a leaderboard row"""
+    return ScoreForm(user_name=row['user_name'], games_won=row['games_won'], score=row['score'],
+                     accuracy=row['accuracy'])
+
+
+def _expired(board):
+    return time.time() - board['built_at'] > BOARD_SECONDS
+
+
+def _build(order):
+    scores = Score.query().order(-getattr(Score, order)).fetch(LEADERBOARD_SIZE)
+    names = get_user_names(scores)
+    return [_row(score, names.get(score.user, '')) for score in scores]
+
+
+def _row(score, user_name):
+    return {'user': score.user.urlsafe(),
+            'user_name': user_name,
+            'games_played': score.games_played,
+            'games_won': score.games_won,
+            'accuracy': score.accuracy,
+            'score': score.score}
+
+
+def _updated(rows, row, order):
+    """Returns rows with row placed by order, rows itself when the board does
+    not change or None when the board has to be rebuilt."""
+    value = row[order]
+    others = [other for other in rows if other['user'] != row['user']]
+    was_listed = len(others) != len(rows)
+    full = len(rows) >= LEADERBOARD_SIZE
+    if full and others and value < others[-1][order]:
+        # A Score that dropped off a full board may now rank below one
+        # that is not listed.
+        return None if was_listed else rows
+    position = 0
+    while position < len(others) and others[position][order] >= value:
+        position += 1
+    others.insert(position, row)
+    return others[:LEADERBOARD_SIZE]
@@ -0,0 +1,17 @@
+"""leaderboard_cache.py - Memcache keys of the leaderboards. Kept apart from
+leaderboard.py, which imports the endpoints service, so task handlers can
+drop the boards without importing it."""
+
+from google.appengine.api import memcache
+
+MEMCACHE_LEADERBOARD = 'LEADERBOARD_{}'
+
+# Boards are ordered by one of these Score properties, best first.
+GAMES_WON = 'games_won'
+ACCURACY = 'accuracy'
+BOARDS = (GAMES_WON, ACCURACY)
+
+
+def clear():
+    """Drops every cached leaderboard, to be rebuilt on its next read"""
+    memcache.delete_multi([MEMCACHE_LEADERBOARD.format(order) for order in BOARDS])
@@ -12,5 +12,7 @@ __version__ = '0.2.0'
 from .random_words import RandomWords
 from .random_words import RandomNicknames
 from .random_words import RandomEmails
+from .random_words import WordPool
+from .random_words import get_word_pool
 
 from .lorem_ipsum import LoremIpsum
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compiled binary corpus format for the ``.dat`` word files.
+
+Layout (all integers are little-endian ``uint32``)::
+
+    magic            b'RWC1'
+    section_count
+    word_count
+    sections         section_count * (name: 16 bytes, start, end)
+    offsets          (word_count + 1) * offset into blob
+    blob             UTF-8 encoded words, back to back
+
+Sections are ``(start, end)`` ranges of word indexes: one per letter for
+nouns (``'a'``), one per gender and letter for nicknames (``'u/a'``) and a
+single ``'domains'`` section for dmails. The file is memory-mapped when
+possible, so pages are shared between processes and words are only decoded
+when accessed.
+
+Build the compiled files with::
+
+    python libs/random_words/corpus.py [nouns nicknames dmails]
+"""
+
+import os
+import sys
+import json
+import struct
+import threading
+
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+
+MAGIC = b'RWC1'
+SUFFIX = '.bin'
+NAME_SIZE = 16
+
+_header = struct.Struct('<4sII')
+_section = struct.Struct('<%dsII' % NAME_SIZE)
+_offset = struct.Struct('<I')
+_span = struct.Struct('<II')
+
+main_dir = os.path.split(os.path.abspath(__file__))[0]
+
+_corpora = {}
+_corpora_lock = threading.Lock()
+
+
+class CorpusSection(Sequence):
+    """
+    Read-only sequence of words for a range of a corpus.
+    """
+    __slots__ = ('corpus', 'start', 'end')
+
+    def __init__(self, corpus, start, end):
+        self.corpus = corpus
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, end, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, end, step)]
+            return CorpusSection(self.corpus, self.start + start,
+                                 self.start + max(start, end))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('corpus index out of range')
+        return self.corpus.word(self.start + index)
+
+    def __iter__(self):
+        word = self.corpus.word
+        for i in range(self.start, self.end):
+            yield word(i)
+
+
+class Corpus(CorpusSection):
+    """
+    Compiled corpus backed by a (memory-mapped) buffer.
+    """
+    __slots__ = ('buf', 'sections', 'offsets_at', 'blob_at')
+
+    def __init__(self, buf):
+        magic, section_count, word_count = _header.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a compiled corpus file.')
+
+        sections = {}
+        position = _header.size
+        for _ in range(section_count):
+            name, start, end = _section.unpack_from(buf, position)
+            sections[name.rstrip(b'\0').decode('ascii')] = (start, end)
+            position += _section.size
+
+        super(Corpus, self).__init__(self, 0, word_count)
+        self.buf = buf
+        self.sections = sections
+        self.offsets_at = position
+        self.blob_at = position + (word_count + 1) * _offset.size
+
+    def word(self, index):
+        """
+        Decode word at index.
+
+        :param int index: word index
+        :rtype: str
+        """
+        start, end = _span.unpack_from(self.buf,
+                                       self.offsets_at + index * _offset.size)
+        return self.buf[self.blob_at + start:self.blob_at + end].decode('utf-8')
+
+    def section(self, name):
+        """
+        Return words of named section.
+
+        :param str name: section name
+        :rtype: CorpusSection
+        """
+        start, end = self.sections[name]
+        return CorpusSection(self, start, end)
+
+
+def corpus_path(file):
+    """
+    :param str file: filename
+    :rtype: str
+    """
+    return os.path.join(main_dir, file + SUFFIX)
+
+
+def load_corpus(file):
+    """
+    Return process-wide compiled corpus for file or None if it is not built.
+
+    :param str file: filename
+    :rtype: Corpus
+    """
+    if file in _corpora:
+        return _corpora[file]
+    with _corpora_lock:
+        if file not in _corpora:
+            _corpora[file] = _open(corpus_path(file))
+    return _corpora[file]
+
+
+def _open(path):
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return None
+    with f:
+        buf = None
+        if mmap is not None:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError):
+                buf = None
+        if buf is None:
+            buf = f.read()
+    return Corpus(buf)
+
+
+def iter_sections(data):
+    """
+    Flatten parsed ``.dat`` data into ``(name, words)`` sections.
+
+    :param data: dict of letter -> words, dict of gender -> letter -> words
+        or list of words
+    """
+    if isinstance(data, list):
+        yield 'domains', data
+        return
+    for key in sorted(data):
+        value = data[key]
+        if isinstance(value, dict):
+            for letter in sorted(value):
+                yield '{0}/{1}'.format(key, letter), value[letter]
+        else:
+            yield key, value
+
+
+def dumps(sections):
+    """
+    Serialize sections into compiled corpus bytes.
+
+    :param sections: iterable of ``(name, words)``
+    :rtype: bytes
+    """
+    table = []
+    offsets = [0]
+    blob = []
+    size = 0
+    for name, words in sections:
+        start = len(offsets) - 1
+        for word in words:
+            encoded = word.encode('utf-8')
+            blob.append(encoded)
+            size += len(encoded)
+            offsets.append(size)
+        name = name.encode('ascii')
+        if len(name) > NAME_SIZE:
+            raise ValueError('Section name "{0}" is too long.'.format(name))
+        table.append(_section.pack(name, start, len(offsets) - 1))
+
+    parts = [_header.pack(MAGIC, len(table), len(offsets) - 1)]
+    parts.extend(table)
+    parts.append(struct.pack('<%dI' % len(offsets), *offsets))
+    parts.extend(blob)
+    return b''.join(parts)
+
+
+def build(file):
+    """
+    Compile ``file.dat`` into ``file.bin``.
+
+    :param str file: filename
+    :rtype: str
+    :returns: path of compiled file
+    """
+    with open(os.path.join(main_dir, file + '.dat'), 'r') as f:
+        data = json.load(f)
+    path = corpus_path(file)
+    with open(path, 'wb') as f:
+        f.write(dumps(iter_sections(data)))
+    return path
+
+
+def main(argv):
+    for file in argv or ('nouns', 'nicknames', 'dmails'):
+        print(build(file))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,11 +2,143 @@
 
 import os
 import json
-from random import sample
+import threading
+from array import array
+from random import sample, randrange
 from itertools import chain
 
+from .corpus import load_corpus
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
 main_dir = os.path.split(os.path.abspath(__file__))[0]
 
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class WordPool(object):
+    """
+    Immutable pool of words stored as one flat tuple.
+
+    Every letter bucket is a contiguous slice of ``words``; ``offsets`` maps
+    each letter to its ``(start, end)`` range, so picking a random word for
+    any letter (or for the whole pool) is a single ``randrange``.
+    """
+    __slots__ = ('words', 'offsets')
+
+    def __init__(self, words, offsets):
+        self.words = words
+        self.offsets = offsets
+
+    @classmethod
+    def from_buckets(cls, buckets):
+        """
+        Build pool from dict of letter -> list of words.
+
+        :param dict buckets: words grouped by first letter
+        :rtype: WordPool
+        """
+        words = []
+        offsets = {}
+        for letter in sorted(buckets):
+            start = len(words)
+            words.extend(buckets[letter])
+            offsets[letter] = (start, len(words))
+        return cls(tuple(words), offsets)
+
+    def __len__(self):
+        return len(self.words)
+
+    def bounds(self, letter=None):
+        """
+        Return ``(start, end)`` range of words for letter.
+
+        :param str letter: letter or None for the whole pool
+        :rtype: tuple
+        """
+        if letter is None:
+            return 0, len(self.words)
+        return self.offsets[letter]
+
+    def bucket(self, letter):
+        """
+        Return words for letter.
+
+        :param str letter: letter
+        :rtype: tuple
+        """
+        start, end = self.offsets[letter]
+        return self.words[start:end]
+
+    def random_word(self, letter=None):
+        """
+        Return random word in O(1).
+
+        :param str letter: letter or None for the whole pool
+        :rtype: str
+        """
+        start, end = self.bounds(letter)
+        return self.words[randrange(start, end)]
+
+    def sample(self, letter=None, count=1):
+        """
+        Return ``count`` distinct random words without copying the pool.
+
+        :param str letter: letter or None for the whole pool
+        :param int count: how much words
+        :rtype: list
+        :raises: ValueError
+        """
+        start, end = self.bounds(letter)
+        words = self.words
+        return [words[i] for i in sample(xrange(start, end), count)]
+
+    def iter_random(self, letter=None):
+        """
+        Yield endless stream of random words.
+
+        Words do not repeat until every word has been drawn, then a new
+        random order starts. Each word costs one step of a lazy Fisher-Yates
+        shuffle over an index array, so memory does not grow with draws.
+
+        :param str letter: letter or None for the whole pool
+        :rtype: generator
+        """
+        start, end = self.bounds(letter)
+        indexes = array('I', xrange(start, end))
+        words = self.words
+        while indexes:
+            for i in xrange(len(indexes) - 1, -1, -1):
+                j = randrange(i + 1)
+                indexes[i], indexes[j] = indexes[j], indexes[i]
+                yield words[indexes[i]]
+
+
+def get_word_pool(file='nouns'):
+    """
+    Return process-wide word pool for file, building it on first use.
+
+    :param str file: filename
+    :rtype: WordPool
+    """
+    pool = _pools.get(file)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(file)
+            if pool is None:
+                corpus = load_corpus(file)
+                if corpus is not None:
+                    pool = WordPool(corpus, corpus.sections)
+                else:
+                    with open(os.path.join(main_dir, file + '.dat'), 'r') as f:
+                        pool = WordPool.from_buckets(json.load(f))
+                _pools[file] = pool
+    return pool
+
 
 class Random(dict):
 
@@ -31,6 +163,11 @@ class Random(dict):
 
         :param str file: filename
         """
+        corpus = load_corpus(file)
+        if corpus is not None:
+            self.nouns = dict((letter, corpus.section(letter))
+                              for letter in corpus.sections)
+            return
         with open(os.path.join(main_dir, file + '.dat'), 'r') as f:
             self.nouns = json.load(f)
 
@@ -40,6 +177,10 @@ class Random(dict):
 
         :param str file: filename
         """
+        corpus = load_corpus(file)
+        if corpus is not None:
+            self['domains'] = corpus.section('domains')
+            return
         with open(os.path.join(main_dir, file + '.dat'), 'r') as f:
             self['domains'] = frozenset(json.load(f))
 
@@ -49,6 +190,14 @@ class Random(dict):
 
         :param str file: filename
         """
+        corpus = load_corpus(file)
+        if corpus is not None:
+            self.nicknames = {}
+            for name in corpus.sections:
+                gender, letter = name.split('/')
+                self.nicknames.setdefault(gender, {})[letter] = \
+                    corpus.section(name)
+            return
         with open(os.path.join(main_dir, file + '.dat'), 'r') as f:
             self.nicknames = json.load(f)
 
@@ -71,6 +220,19 @@ class RandomWords(Random):
         super(RandomWords, self).__init__('nouns')
         self.available_letters = 'qwertyuiopasdfghjklzcvbnm'
 
+    def load_nouns(self, file):
+        """
+        Use shared word pool instead of parsing file for every instance.
+
+        :param str file: filename
+        """
+        self.pool = get_word_pool(file)
+
+    @property
+    def nouns(self):
+        pool = self.pool
+        return dict((letter, pool.bucket(letter)) for letter in pool.offsets)
+
     def random_word(self, letter=None):
         """
         Return random word.
@@ -79,6 +241,8 @@ class RandomWords(Random):
         :rtype: str
         :returns: random word
         """
+        if letter is None:
+            return self.pool.random_word()
         return self.random_words(letter)[0]
 
     def random_words(self, letter=None, count=1):
@@ -94,13 +258,10 @@ class RandomWords(Random):
         self.check_count(count)
 
         if letter is None:
-            all_words = list(
-                chain.from_iterable(self.nouns.values()))
-
             try:
-                words = sample(all_words, count)
+                words = self.pool.sample(None, count)
             except ValueError:
-                len_sample = len(all_words)
+                len_sample = len(self.pool)
                 raise ValueError('Param "count" must be less than {0}. \
 (It is only {0} words)'.format(len_sample + 1, letter))
 
@@ -114,14 +275,35 @@ class RandomWords(Random):
 
         elif letter in self.available_letters:
             try:
-                words = sample(self.nouns[letter], count)
+                words = self.pool.sample(letter, count)
             except ValueError:
-                len_sample = len(self.nouns[letter])
+                start, end = self.pool.bounds(letter)
                 raise ValueError('Param "count" must be less than {0}. \
-(It is only {0} words for letter "{1}")'.format(len_sample + 1, letter))
+(It is only {0} words for letter "{1}")'.format(end - start + 1, letter))
 
         return words
 
+    def iter_random_words(self, letter=None):
+        """
+        Returns endless generator of random words without repeats until
+        all words were used. Use it instead of ``random_words`` for large
+        counts.
+
+        :param str letter: letter
+        :rtype: generator
+        :returns: generator of random words
+        :raises: ValueError
+        """
+        if letter is not None:
+            if type(letter) is not str:
+                raise ValueError('Param "letter" must be string.')
+            if letter not in self.available_letters:
+                raise ValueError(
+                    'Param "letter" must be in {0}.'.format(
+                        self.available_letters))
+
+        return self.pool.iter_random(letter)
+
 
 class RandomNicknames(Random):
     def __init__(self):
@@ -1,39 +1,54 @@
 #!/usr/bin/env python
 
-"""main.py - This file contains handlers that are called by taskqueue and/or
-cronjobs."""
+"""main.py - This file contains the WSGI app of the handlers that are called
+by taskqueue and/or cronjobs, and of the admin and warmup handlers. Task and
+cron handlers are given by name and imported by webapp2 on their first
+request, so starting an instance does not import the models or the API."""
 
 
+import importlib
+import json
+
 import webapp2
-from google.appengine.api import mail, app_identity
-from api import HangmanApi
 
-from models import User, Game
+import instrumentation
 
 
-class SendReminderEmail(webapp2.RequestHandler):
+class Warmup(webapp2.RequestHandler):
 
     def get(self):
-        """Send a reminder email to each User with an email about games.
-        Called every hour using a cron job"""
-        app_id = app_identity.get_application_id()
-        users = User.query(User.email != None)
-
-        for user in users:
-            active_game = Game.query(Game.user == user.key, Game.game_over == False, Game.game_canceled == False)
-            if active_game:
-                subject = 'This is a reminder!'
-                body = 'Hello {}, you have not finish your game yet! play Hangman now!'.format(user.name)
-                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id), user.email, subject, body)
-
-
-class UpdateAverageMovesRemaining(webapp2.RequestHandler):
-
-    def post(self):
-        """Update game listing announcement in memcache."""
-        HangmanApi._cache_average_attempts()
+        """Import the API and load the word pool, the difficulty index and the
+        attempt budgets before the instance is sent user requests."""
+        # The endpoints service, models and engine.
+        importlib.import_module('api')
+        from random_words import get_word_pool
+        from difficulty import get_word_index
+        from budgets import get_budgets
+        get_word_pool()
+        get_word_index()
+        get_budgets()
         self.response.set_status(204)
 
 
-app = webapp2.WSGIApplication([('/crons/send_reminder', SendReminderEmail),
-                               ('/tasks/cache_average_attempts', UpdateAverageMovesRemaining),], debug=True)
+class RequestStats(webapp2.RequestHandler):
+
+    def get(self):
+        """Show the request stats of this instance for the recent minutes."""
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(instrumentation.get_stats(), indent=2, sort_keys=True))
+
+
+app = webapp2.WSGIApplication([('/crons/send_reminder', 'tasks.SendReminderEmail'),
+                               ('/tasks/send_reminder', 'tasks.SendReminderEmail'),
+                               ('/crons/reconcile_active_games', 'tasks.ReconcileActiveGames'),
+                               ('/tasks/cache_average_attempts', 'tasks.UpdateAverageMovesRemaining'),
+                               ('/tasks/flush_moves', 'tasks.FlushMoves'),
+                               ('/tasks/merge_scores', 'tasks.MergeScores'),
+                               ('/tasks/rekey_users', 'tasks.RekeyUsers'),
+                               ('/tasks/move_histories', 'tasks.MoveHistories'),
+                               ('/tasks/export', 'tasks.ExportChunks'),
+                               ('/tasks/recompute_scores', 'tasks.RecomputeScores'),
+                               ('/admin/export', 'tasks.ExportEntities'),
+                               ('/_ah/warmup', Warmup),
+                               ('/admin/stats', RequestStats),], debug=True)
+app = instrumentation.instrument(app)
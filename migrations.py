@@ -0,0 +1,143 @@
+"""migrations.py - One-off jobs that move existing entities to a new layout.
+Every job handles one page of entities per call and returns the cursor of the
+next page, so the handlers in main.py can chain them across tasks."""
+
+import logging
+
+from google.appengine.ext import ndb
+
+from models import User, Game, Score, History, SCORE_ID
+from engine import RESULTS, CANCELED
+import game_cache
+
+PAGE_SIZE = 100
+# History result text -> result code, for History saved before it was coded
+_RESULT_CODES = dict((result, code) for code, (result, _, _, _) in RESULTS.items())
+
+
+def merge_scores(cursor=None, page_size=PAGE_SIZE):
+    """Merges one page of Score rows that are not keyed by their user into
+    the user's Score, so every user is left with exactly one Score.
+    Args:
+        cursor: The Cursor of the page or None for the first page
+        page_size: The number of Score rows per page
+    Returns:
+        The number of merged rows and the Cursor of the next page or None"""
+    scores, next_cursor, more = Score.query().fetch_page(page_size, start_cursor=cursor)
+    merged = 0
+    for score in scores:
+        if score.key != Score.key_for(score.user):
+            _merge_score(score.key)
+            merged += 1
+    return merged, next_cursor if more else None
+
+
+def has_legacy_scores():
+    """Returns True if any Score row is not keyed by its user, scanning the
+    Score keys"""
+    for key in Score.query().iter(keys_only=True, batch_size=1000):
+        if key.parent() is None or key.id() != SCORE_ID:
+            return True
+    return False
+
+
+def rekey_users(cursor=None, page_size=PAGE_SIZE):
+    """Moves one page of Users with auto-generated ids to keys made from
+    their name, together with their Games and Scores. Run merge_scores first.
+    Args:
+        cursor: The Cursor of the page or None for the first page
+        page_size: The number of Users per page
+    Returns:
+        The number of moved Users and the Cursor of the next page or None"""
+    users, next_cursor, more = User.query().fetch_page(page_size, start_cursor=cursor)
+    moved = 0
+    for user in users:
+        if user.key != User.key_for(user.name):
+            _rekey_user(user)
+            moved += 1
+    return moved, next_cursor if more else None
+
+
+def move_histories(cursor=None, page_size=PAGE_SIZE):
+    """Moves one page of History entries saved as root entities with a game
+    property and a result text to children of their Game with a result code.
+    The moved entry keeps the id of the old one, so the job can be run again
+    after a failure.
+    Args:
+        cursor: The Cursor of the page or None for the first page
+        page_size: The number of History entries per page
+    Returns:
+        The number of moved entries and the Cursor of the next page or None"""
+    histories, next_cursor, more = History.query().fetch_page(page_size, start_cursor=cursor)
+    moved = []
+    old_keys = []
+    for history in histories:
+        if history.key.parent() is not None:
+            continue
+        # The removed properties are still loaded, as generic properties.
+        values = history.to_dict()
+        code = CANCELED if values.get('game_canceled') else _RESULT_CODES.get(values.get('result'))
+        if values.get('game') is None or code is None:
+            logging.warning('Not moving History %s with result %r', history.key, values.get('result'))
+            continue
+        moved.append(History(parent=values['game'], id=history.key.id(), date_time=history.date_time,
+                             guess=history.guess, code=code))
+        old_keys.append(history.key)
+    ndb.put_multi(moved)
+    ndb.delete_multi(old_keys)
+    return len(moved), next_cursor if more else None
+
+
+def _rekey_user(user):
+    """Copies the User to its name key, points its Games and Score at the new
+    key and deletes the old User last, so the job can be run again after a
+    failure."""
+    old_key = user.key
+    new_key = User.key_for(user.name)
+    # Users that share a name, created by racing create_user calls, are
+    # merged into one.
+    if new_key.get() is None:
+        User(key=new_key, name=user.name, email=user.email).put()
+
+    games = Game.query(Game.user == old_key).fetch()
+    for game in games:
+        game.user = new_key
+        game.version = (game.version or 0) + 1
+    ndb.put_multi(games)
+    game_cache.delete_multi([game.key for game in games])
+
+    for score in Score.query(Score.user == old_key).fetch():
+        _move_score(score.key, new_key)
+
+    old_key.delete()
+
+
+@ndb.transactional(xg=True)
+def _move_score(key, user):
+    score = key.get()
+    if score is None:
+        return
+    moved = Score.key_for(user).get()
+    if moved is None:
+        score.key = Score.key_for(user)
+        score.user = user
+        score.put()
+    else:
+        moved.merge(score)
+        moved.put()
+    key.delete()
+
+
+@ndb.transactional(xg=True)
+def _merge_score(key):
+    legacy = key.get()
+    if legacy is None:
+        return
+    score = Score.key_for(legacy.user).get()
+    if score is None:
+        legacy.key = Score.key_for(legacy.user)
+        legacy.put()
+    else:
+        score.merge(legacy)
+        score.put()
+    key.delete()
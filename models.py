@@ -8,17 +8,89 @@ from protorpc import messages, message_types
 from google.appengine.ext import ndb
 
 
-from random_words import RandomWords
+from random_words import get_word_pool
+from difficulty import get_word_index
+from budgets import get_attempt_budget
+from engine import RESULTS, CANCELED
+import counters
+import game_cache
+from game_cache import StaleGameError
+
+SCORE_ID = 'score'
+
+
+def get_user_names(entities):
+    """Returns dict of user key -> user name for the users of entities with
+    user and user_name properties. Denormalized names are used as they are
+    and the remaining users are fetched with a single get_multi."""
+    names = {}
+    missing = set()
+    for entity in entities:
+        if entity.user_name:
+            names[entity.user] = entity.user_name
+        else:
+            missing.add(entity.user)
+    missing.difference_update(names)
+    for user in ndb.get_multi(list(missing)):
+        if user:
+            names[user.key] = user.name
+    return names
+
+
+def user_name_of(entity, names=None):
+    """Returns the user name of an entity with user and user_name properties,
+    reading the user only when the name is neither denormalized nor in names"""
+    if entity.user_name:
+        return entity.user_name
+    if names and entity.user in names:
+        return names[entity.user]
+    return entity.user.get().name
 
 
 class User(ndb.Model):
-    """User profile"""
+    """User profile. Users are keyed by their unique name, so a lookup by
+    name is a get by key, which ndb's default memcache caching serves."""
+
     name = ndb.StringProperty(required=True)
     email =ndb.StringProperty()
 
+    @classmethod
+    def key_for(cls, name):
+        """Returns the key of the User with a name"""
+        return ndb.Key(cls, name)
+
+    @classmethod
+    def get_by_name(cls, name):
+        """Returns the User with a name or None, also for a missing or empty
+        name"""
+        if not name:
+            return None
+        return cls.key_for(name).get()
+
+    @classmethod
+    @ndb.transactional
+    def create(cls, name, email=None):
+        """Creates a User in a transaction, so two requests cannot create the
+        same name.
+        Returns:
+            The new User or None if the name is taken
+        Raises:
+            ValueError: for a missing or empty name"""
+        if not name:
+            raise ValueError('A user name is required')
+        key = cls.key_for(name)
+        if key.get():
+            return None
+        user = cls(key=key, name=name, email=email)
+        user.put()
+        return user
+
 
 class Game(ndb.Model):
-    """Game object"""
+    """Game object. Games are cached by game_cache instead of ndb's memcache
+    cache, and version counts the saves of the game."""
+    _use_memcache = False
+
     target = ndb.StringProperty(required=True)
     attempts_allowed = ndb.IntegerProperty(required=True)
     attempts_remaining = ndb.IntegerProperty(required=True)
@@ -26,100 +98,145 @@ class Game(ndb.Model):
     letters_used = ndb.StringProperty(repeated=True)
     game_over = ndb.BooleanProperty(required=True, default=False)
     user = ndb.KeyProperty(required=True, kind='User')
+    user_name = ndb.StringProperty(indexed=False)
     game_canceled = ndb.BooleanProperty(required=True, default=False)
+    version = ndb.IntegerProperty(indexed=False)
+    # Logged moves of movelog applied to the game, whether saved or not
+    log_sequence = ndb.IntegerProperty(indexed=False)
 
     @classmethod
-    def new_game(cls, user):
+    def new_game(cls, user, difficulty=None, min_length=None, max_length=None, user_name=None):
 
-        """Creates and returns a new game"""
-        rw = RandomWords()
-        RANDOM_WORD = rw.random_word()
+        """Creates and returns a new game. The target word can be restricted
+        to a difficulty tier name and/or a range of lengths."""
+        if difficulty is None and min_length is None and max_length is None:
+            RANDOM_WORD = get_word_pool().random_word()
+        else:
+            RANDOM_WORD = get_word_index().choose(difficulty, min_length, max_length)
 
+        _attempts = get_attempt_budget(RANDOM_WORD)
         _progress = ['_'] * len(RANDOM_WORD)
-        _letters_used = ['_'] * len(RANDOM_WORD)
+        _letters_used = ['_'] * _attempts
 
         game = Game(user=user,
+                    user_name=user_name,
                     target=RANDOM_WORD,
-                    attempts_allowed=len(RANDOM_WORD),
-                    attempts_remaining=len(RANDOM_WORD),
+                    attempts_allowed=_attempts,
+                    attempts_remaining=_attempts,
                     progress=_progress,
                     letters_used=_letters_used,
                     game_over=False,
                     game_canceled=False)
-        game.put()
+        counted = counters.adjust_async(1, game.attempts_remaining)
+        game.save()
+        counted.get_result()
         return game
 
+    def save(self, entities=(), moves=1, won=None):
+        """Saves the game and writes it through to the game cache. entities,
+        History entries of the game, are saved in the same transaction. The
+        game is only saved if no other request saved it since it was read.
+        moves is the number of saves the version advances by, more than one
+        when logged moves are flushed together. won is given when the save
+        ends the game, and the result is then added to the user's Score in
+        the same transaction, so a finished game is never left unscored.
+        Returns:
+            The updated Score if won is given, else None
+        Raises:
+            StaleGameError: if another request saved the game first, after
+                dropping the game from the cache"""
+        read_version = self.version
+        self.version = (read_version or 0) + moves
+        score = None
+        try:
+            if self.key is None:
+                self.put()
+            else:
+                score = self._put_unless_changed(read_version, list(entities), won)
+        except StaleGameError:
+            # The cached Game may be what is behind, so the retry reads the
+            # stored one.
+            self.version = read_version
+            game_cache.delete_multi([self.key])
+            raise
+        game_cache.store(self)
+        return score
+
+    @ndb.transactional(xg=True)
+    def _put_unless_changed(self, read_version, entities, won=None):
+        if won is None:
+            stored, score = self.key.get(), None
+        else:
+            stored, score = ndb.get_multi([self.key, Score.key_for(self.user)])
+        if stored is not None and stored.version != read_version:
+            raise StaleGameError('Game was changed by another request')
+        if won is not None:
+            if score is None:
+                score = Score.new_score(self.user)
+            if self.user_name:
+                score.user_name = self.user_name
+            score.add_game(won, self.attempts_allowed - self.attempts_remaining)
+            entities = entities + [score]
+        ndb.put_multi([self] + entities)
+        return score
+
+    @classmethod
+    def count_active(cls):
+        """Returns the number of active games and their total attempts
+        remaining, counted with a projection scan"""
+        games = attempts_remaining = 0
+        query = cls.query(cls.game_over == False, cls.game_canceled == False)
+        for game in query.iter(projection=[cls.attempts_remaining], batch_size=1000):
+            games += 1
+            attempts_remaining += game.attempts_remaining
+        return games, attempts_remaining
+
     def cancel_the_game(self):
-        """Cancel the game."""
+        """Cancel the game. The game is saved together with its history.
+        Raises:
+            StaleGameError: if another request saved the game first"""
         self.game_canceled = True
-        self.put()
+        self.save([self.new_history("", CANCELED)])
+        counters.adjust_async(-1, -self.attempts_remaining).get_result()
 
-    def to_form(self, message):
-        """Returns a GameForm representation of the Game"""
+    def to_form(self, message, names=None, compact=False):
+        """Returns a GameForm representation of the Game. names is an optional
+        dict of user key -> name from get_user_names. If compact, progress and
+        letters used are sent as single strings."""
         form = GameForm()
         form.urlsafe_key = self.key.urlsafe()
-        form.user_name = self.user.get().name
+        form.version = self.version or 0
+        form.user_name = user_name_of(self, names)
         form.attempts_remaining = self.attempts_remaining
         form.game_over = self.game_over
         form.message = message
-        form.progress = self.progress
-        form.lettersUsed = self.letters_used
+        if compact:
+            form.progress_text = ''.join(self.progress)
+            form.letters_used_text = ''.join(self.letters_used)
+        else:
+            form.progress = self.progress
+            form.lettersUsed = self.letters_used
         form.game_canceled = self.game_canceled
         return form
 
-    def post_transaction(self, guess, result, game_over, game_canceled):
-        history = History(game=self.key, guess=guess, result=result, game_over=game_over, game_canceled=game_canceled)
-        history.put()
+    def new_history(self, guess, outcome, date_time=None):
+        """Returns an unsaved History entry of the game for a guess and its
+        outcome code from engine"""
+        history = History(parent=self.key, guess=guess, code=outcome)
+        if date_time is not None:
+            history.date_time = date_time
         return history
 
-    def end_game(self, won=False):
-        """Ends the game - if won is True, the player won. - if won is False,
-        the player lost."""
-        self.game_over = True
-        self.put()
-        # Update Score
-        _scores = Score.query(Score.user == self.user)
-        _score_count = _scores.count()
-        _score = _scores.get()
+    def get_history_query(self):
+        """Returns a strongly consistent query of the History of the game,
+        latest first"""
+        return History.query(ancestor=self.key).order(-History.date_time)
 
-        guesses = self.attempts_allowed - self.attempts_remaining
-
-        if won:
-            if _score_count == 0:
-                score = Score(user=self.user, date=date.today(), guesses=guesses)
-                score.games_played = 1
-                score.games_won = 1
-                score.games_lost = 0
-                score.accuracy = 100.00
-                score.score = 2
-                score.put()
-            else:
-                _score.guesses = _score.guesses + guesses
-                _score.date=date.today()
-                _score.games_played += 1
-                _score.games_won += 1
-                _score.games_lost = _score.games_lost
-                _score.accuracy = ((_score.games_won / _score.games_played) / _score.guesses) * 100
-                _score.score += 2
-                _score.put()
-        else:
-            if _score_count == 0:
-                score = Score(user=self.user, date=date.today(), guesses=guesses)
-                score.games_played = 1
-                score.games_won = 0
-                score.games_lost = 1
-                score.accuracy = 0.00
-                score.score += 0
-                score.put()
-            else:
-                _score.date=date.today()
-                _score.guesses = _score.guesses + guesses
-                _score.games_played += 1
-                _score.games_won = _score.games_won
-                _score.games_lost += 1
-                _score.accuracy = ((_score.games_won / _score.games_played) / _score.guesses) * 100
-                _score.score += 2
-                _score.put()
+    @staticmethod
+    def to_forms(games, message, next_cursor=None):
+        """Returns GameForms of games, resolving their user names at once"""
+        names = get_user_names(games)
+        return GameForms(items=[game.to_form(message, names) for game in games], next_cursor=next_cursor)
 
     def game_status(self, message):
         """Returns a GameForm representation of the Game"""
@@ -127,15 +244,17 @@ class Game(ndb.Model):
         form.message = message
         form.attempts_remaining = self.attempts_remaining
         form.urlsafe_key = self.key.urlsafe()
-        form.user_name = self.user.get().name
+        form.version = self.version or 0
+        form.user_name = user_name_of(self)
         form.game_over = self.game_over
         form.game_canceled = self.game_canceled
         return form
 
 
 class Score(ndb.Model):
-    """Score object"""
+    """Score object. There is one Score per user, keyed by the user"""
     user = ndb.KeyProperty(required=True, kind='User')
+    user_name = ndb.StringProperty(indexed=False)
     date = ndb.DateProperty(required=True)
     guesses = ndb.IntegerProperty(required=True)
     games_played = ndb.IntegerProperty(required=True)
@@ -144,39 +263,101 @@ class Score(ndb.Model):
     games_lost = ndb.IntegerProperty(required=True)
     score = ndb.IntegerProperty(required=True)
 
-    def get_score(self):
-        """Returns a ScoreForm"""
-        return ScoreForm(user_name=self.user.get().name, games_played=self.games_played, games_won=self.games_won,
-                         accuracy=self.accuracy, score=self.score)
+    @classmethod
+    def key_for(cls, user):
+        """Returns the key of the Score of a user key"""
+        return ndb.Key(cls, SCORE_ID, parent=user)
 
-    def get_ranking(self):
-        return ScoreForm(user_name=self.user.get().name, games_won=self.games_won, score=self.score, accuracy=self.accuracy)
+    @classmethod
+    def new_score(cls, user, user_name=None):
+        """Returns an unsaved Score of a user key without any games"""
+        return cls(key=cls.key_for(user), user=user, user_name=user_name, date=date.today(), guesses=0,
+                   games_played=0, games_won=0, games_lost=0, accuracy=0.00, score=0)
+
+    def add_game(self, won, guesses):
+        """Adds the result of a finished game. A win adds 2 points to the
+        score, a loss none."""
+        self.date = date.today()
+        self.guesses += guesses
+        self.games_played += 1
+        if won:
+            self.games_won += 1
+            self.score += 2
+        else:
+            self.games_lost += 1
+        self.update_accuracy()
+
+    def merge(self, other):
+        """Adds the games of another Score row of the same user"""
+        self.date = max(self.date, other.date)
+        self.guesses += other.guesses
+        self.games_played += other.games_played
+        self.games_won += other.games_won
+        self.games_lost += other.games_lost
+        self.score += other.score
+        self.update_accuracy()
+
+    def update_accuracy(self):
+        """Accuracy is wins divided by games played * 100 and divided by
+        guesses. Winning without a wrong guess counts as 100."""
+        if not self.games_won:
+            self.accuracy = 0.00
+        elif not self.guesses:
+            self.accuracy = 100.00
+        else:
+            self.accuracy = ((self.games_won / self.games_played) / self.guesses) * 100
+
+    def get_score(self, names=None):
+        """Returns a ScoreForm. names is an optional dict of user key -> name
+        from get_user_names"""
+        return ScoreForm(user_name=user_name_of(self, names), games_played=self.games_played,
+                         games_won=self.games_won, accuracy=self.accuracy, score=self.score)
+
+    def get_ranking(self, names=None):
+        return ScoreForm(user_name=user_name_of(self, names), games_won=self.games_won, score=self.score,
+                         accuracy=self.accuracy)
+
+    @staticmethod
+    def to_forms(scores, next_cursor=None, ranking=False):
+        """Returns ScoreForms of scores, or of their rankings, resolving their
+        user names at once"""
+        names = get_user_names(scores)
+        if ranking:
+            items = [score.get_ranking(names) for score in scores]
+        else:
+            items = [score.get_score(names) for score in scores]
+        return ScoreForms(items=items, next_cursor=next_cursor)
 
 
 class History(ndb.Model):
-    """History object"""
+    """History object, a child of its Game. code is the outcome of the guess
+    from engine, the result texts are rebuilt from it."""
     date_time = ndb.DateTimeProperty(auto_now_add=True)
-    game = ndb.KeyProperty(required=True, kind='Game')
-    guess = ndb.StringProperty(required=True)
-    result = ndb.StringProperty(required=True)
-    game_over = ndb.BooleanProperty(required=True)
-    game_canceled = ndb.BooleanProperty(required=True)
+    guess = ndb.StringProperty(required=True, indexed=False)
+    code = ndb.IntegerProperty(required=True, indexed=False)
 
     def get_history(self):
-        return HistoryForm(date_time=self.date_time, guess=self.guess, result=self.result, game_over=self.game_over,
-                           game_canceled=self.game_canceled)
+        result, _, game_over, _ = RESULTS[self.code]
+        return HistoryForm(date_time=self.date_time, guess=self.guess, result=result, game_over=game_over,
+                           game_canceled=self.code == CANCELED)
 
 
 class GameForm(messages.Message):
-    """GameForm for outbound game state information"""
+    """GameForm for outbound game state information. A not_modified reply
+    only carries urlsafe_key and version, and a compact one sends progress
+    and letters used as single strings instead of repeated letters."""
     urlsafe_key = messages.StringField(1, required=True)
-    game_over = messages.BooleanField(3, required=True)
-    message = messages.StringField(4, required=True)
-    user_name = messages.StringField(5, required=True)
+    game_over = messages.BooleanField(3)
+    message = messages.StringField(4)
+    user_name = messages.StringField(5)
     progress = messages.StringField(6, repeated=True)
     lettersUsed = messages.StringField(7, repeated=True)
-    game_canceled = messages.BooleanField(8, required=True)
-    attempts_remaining = messages.IntegerField(9, required=True)
+    game_canceled = messages.BooleanField(8)
+    attempts_remaining = messages.IntegerField(9)
+    version = messages.IntegerField(10)
+    not_modified = messages.BooleanField(11)
+    progress_text = messages.StringField(12)
+    letters_used_text = messages.StringField(13)
 
 
 class HistoryForm(messages.Message):
@@ -190,11 +371,22 @@ class HistoryForm(messages.Message):
 class HistoryForms(messages.Message):
     """Return multiple ScoreForms"""
     items = messages.MessageField(HistoryForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+
+
+class Difficulty(messages.Enum):
+    """Difficulty of the target word"""
+    EASY = 1
+    MEDIUM = 2
+    HARD = 3
 
 
 class NewGameForm(messages.Message):
     """Used to create a new game"""
     user_name = messages.StringField(1, required=True)
+    difficulty = messages.EnumField(Difficulty, 2)
+    min_length = messages.IntegerField(3)
+    max_length = messages.IntegerField(4)
 
 
 class MakeMoveForm(messages.Message):
@@ -202,6 +394,23 @@ class MakeMoveForm(messages.Message):
     guess = messages.StringField(1, required=True)
 
 
+class MakeMovesForm(messages.Message):
+    """Used to make several moves in an existing game"""
+    guesses = messages.StringField(1, repeated=True)
+
+
+class MoveResultForm(messages.Message):
+    """Result of a single guess of MakeMovesForm"""
+    guess = messages.StringField(1, required=True)
+    message = messages.StringField(2, required=True)
+
+
+class MovesForm(messages.Message):
+    """Game state after MakeMovesForm with the result of every applied guess"""
+    game = messages.MessageField(GameForm, 1, required=True)
+    results = messages.MessageField(MoveResultForm, 2, repeated=True)
+
+
 class ScoreForm(messages.Message):
     """ScoreForm for outbound Score information"""
     user_name = messages.StringField(1, required=True)
@@ -217,11 +426,13 @@ class ScoreForm(messages.Message):
 class ScoreForms(messages.Message):
     """Return multiple ScoreForms"""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class GameForms(messages.Message):
     """Return multiple ScoreForms"""
     items = messages.MessageField(GameForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 
 class StringMessage(messages.Message):
@@ -0,0 +1,160 @@
+"""movelog.py - Optional write-behind mode for moves of games in progress.
+
+When the WRITE_BEHIND_MOVES environment variable is 'true', a move that does
+not end the game is appended to a per-game log in memcache and the new game
+state is only written to the game cache. A task flushes the logged moves to
+the Game and its History in one batch a little later, and a move that ends or
+cancels the game flushes the log synchronously first.
+
+The rules are deterministic, so the log only keeps the guesses: flushing, or
+recovering a game whose cached state was evicted, replays them on top of the
+Game stored in the datastore. The log is numbered by Game.log_sequence, the
+count of logged moves applied to the game, rather than by Game.version, so
+other writes that save the game do not shift which moves are still unsaved.
+Memcache can still evict a log before it is flushed, in which case those
+moves are lost."""
+
+import logging
+import os
+import time
+from datetime import datetime
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+import counters
+import game_cache
+from engine import GameState
+from game_cache import StaleGameError
+
+MEMCACHE_MOVE_LOG = 'MOVE_LOG_{}'
+FLUSH_DELAY = 30
+CAS_RETRIES = 5
+
+
+def enabled():
+    """Returns True if moves are written behind"""
+    return os.environ.get('WRITE_BEHIND_MOVES', '').lower() == 'true'
+
+
+def append(game, guess):
+    """Logs a move that was applied to game without ending it, writes game to
+    the game cache and schedules a flush.
+    Raises:
+        StaleGameError: if another move was logged since game was read"""
+    read_sequence = game.log_sequence or 0
+    name = MEMCACHE_MOVE_LOG.format(game.key.urlsafe())
+    move = (guess, datetime.now())
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        log = client.gets(name)
+        if log is None:
+            if client.add(name, {'base_sequence': read_sequence, 'moves': [move]}):
+                break
+        else:
+            if log['base_sequence'] + len(log['moves']) != read_sequence:
+                raise StaleGameError('Game was changed by another request')
+            log['moves'].append(move)
+            if client.cas(name, log):
+                break
+    else:
+        raise StaleGameError('Game was changed by another request')
+
+    game.log_sequence = read_sequence + 1
+    game.version = (game.version or 0) + 1
+    game_cache.store(game)
+    _schedule_flush(game.key)
+
+
+def load(key):
+    """Reads a Game from the datastore and applies its logged moves that
+    were not flushed yet. Used by game_cache on a cache miss."""
+    game = key.get()
+    if game is not None:
+        log = memcache.get(MEMCACHE_MOVE_LOG.format(key.urlsafe()))
+        if log:
+            unsaved = _unsaved(log, game.log_sequence or 0)
+            if unsaved:
+                _replay(game, unsaved)
+                game.log_sequence = (game.log_sequence or 0) + len(unsaved)
+                game.version = (game.version or 0) + len(unsaved)
+    return game
+
+
+def flush(key):
+    """Saves the logged moves of a game that are not stored yet to the Game
+    and its History in one batch and removes the saved moves from the log."""
+    name = MEMCACHE_MOVE_LOG.format(key.urlsafe())
+    client = memcache.Client()
+    log = client.get(name)
+    if not log or not log['moves']:
+        return
+
+    game = key.get(use_cache=False)
+    sequence = (game.log_sequence or 0) if game else None
+    unsaved = _unsaved(log, sequence)
+    if unsaved is None:
+        logging.error('Dropping %d logged moves of game %s at sequence %s, stored sequence is %s',
+                      len(log['moves']), key, log['base_sequence'], sequence)
+        client.delete(name)
+        game_cache.delete_multi([key])
+        return
+
+    if unsaved:
+        attempts_before = game.attempts_remaining
+        histories = _replay(game, unsaved)
+        game.log_sequence = sequence + len(unsaved)
+        try:
+            game.save(histories, moves=len(unsaved))
+        except StaleGameError:
+            # Another flush saved the same moves first.
+            return
+        counters.adjust_for_move_async(attempts_before, game.attempts_remaining, False).get_result()
+    _trim(client, name, game.log_sequence or 0)
+
+
+def _unsaved(log, sequence):
+    """Returns the moves of a log that a Game stored at log sequence does not
+    include yet, or None if the log does not continue from that sequence.
+    Moves up to the stored sequence were saved by an earlier flush whose log
+    was not trimmed yet."""
+    base_sequence = log['base_sequence']
+    if sequence is None or not base_sequence <= sequence <= base_sequence + len(log['moves']):
+        return None
+    return log['moves'][sequence - base_sequence:]
+
+
+def _trim(client, name, sequence):
+    """Removes the moves saved up to sequence from the start of a log. A log
+    left untrimmed is trimmed by the next flush instead."""
+    for _ in range(CAS_RETRIES):
+        log = client.gets(name)
+        if log is None or log['base_sequence'] >= sequence:
+            return
+        saved = sequence - log['base_sequence']
+        if client.cas(name, {'base_sequence': sequence, 'moves': log['moves'][saved:]}):
+            return
+
+
+def _replay(game, moves):
+    """Applies logged moves to game.
+    Returns:
+        The unsaved History entries of the moves"""
+    state = GameState.from_game(game)
+    histories = []
+    for guess, date_time in moves:
+        histories.append(game.new_history(guess, state.guess(guess), date_time))
+    state.apply_to(game)
+    return histories
+
+
+def _schedule_flush(key):
+    """Enqueues one flush task per game every FLUSH_DELAY seconds"""
+    window = int(time.time()) // FLUSH_DELAY
+    try:
+        taskqueue.add(url='/tasks/flush_moves',
+                      name='flush-moves-{}-{}'.format(key.id(), window),
+                      params={'game': key.urlsafe()},
+                      countdown=FLUSH_DELAY)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
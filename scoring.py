@@ -0,0 +1,121 @@
+"""scoring.py - Recomputes Scores from the finished Games of their users and
+the History of those games, replacing counts that drifted from the truth.
+
+A game is won when its last History entry is a win. Its guesses are the
+attempts it used, as when the game ended. Users are handled a page at a time
+and the Scores of a page are computed in parallel. Run /tasks/move_histories
+first, since only History stored under its Game is read, and
+/tasks/merge_scores, since a user's Score rows that are not keyed by the user
+are found with an eventually consistent query. Those that are found are
+deleted together with the save of the recomputed Score, which counts their
+games.
+
+Live Scores keep changing while this runs, so every changed Score is written
+in its own transaction that replaces it only if it still holds the values
+read before its games were queried; a Score that changed is left for the
+next run and reported. The query of finished games is eventually
+consistent, so a game that ended moments before the run may still be
+missed."""
+
+from google.appengine.ext import ndb
+
+from engine import WON
+from models import User, Game, Score
+
+PAGE_SIZE = 100
+# Score properties that are recomputed, and compared with the stored values
+FIELDS = ('games_played', 'games_won', 'games_lost', 'guesses', 'accuracy', 'score')
+
+
+@ndb.tasklet
+def _won_async(game):
+    """Returns True if a finished game was won, False if it was lost or None
+    if it has no History"""
+    last = yield game.get_history_query().fetch_async(1)
+    raise ndb.Return(last[0].code == WON if last else None)
+
+
+@ndb.tasklet
+def compute_score_async(user):
+    """Computes the Score of a User from its finished games.
+    Returns:
+        A Future of the unsaved Score, or None if the user finished no game,
+        and the number of finished games skipped for lack of History"""
+    games = yield Game.query(Game.user == user.key, Game.game_over == True).fetch_async()
+    results = yield [_won_async(game) for game in games]
+    score = Score.new_score(user.key, user.name)
+    skipped = 0
+    for game, won in zip(games, results):
+        if won is None:
+            skipped += 1
+        else:
+            score.add_game(won, game.attempts_allowed - game.attempts_remaining)
+    raise ndb.Return((score if score.games_played else None, skipped))
+
+
+def diff(current, computed):
+    """Returns dict of property -> (current value, computed value) of the
+    FIELDS that differ between two Scores, either of which may be None"""
+    changes = {}
+    for field in FIELDS:
+        old = getattr(current, field) if current else None
+        new = getattr(computed, field) if computed else None
+        if old != new and not (isinstance(old, float) and new is not None and abs(old - new) < 1e-9):
+            changes[field] = (old, new)
+    return changes
+
+
+def fetch_users(cursor=None, page_size=PAGE_SIZE):
+    """Returns one page of Users and the Cursor of the next page or None"""
+    users, next_cursor, more = User.query().fetch_page(page_size, start_cursor=cursor)
+    return users, next_cursor if more else None
+
+
+@ndb.transactional_tasklet(xg=True)
+def _replace_async(read, computed, legacy_keys):
+    """Saves a recomputed Score and deletes the legacy Score rows of its user
+    if the stored Score still matches the one read before recomputing,
+    either of which may be None.
+    Returns:
+        A Future of True if the Score was saved"""
+    stored = yield computed.key.get_async()
+    if diff(stored, read) or (stored and stored.date != read.date):
+        raise ndb.Return(False)
+    yield computed.put_async(), ndb.delete_multi_async(legacy_keys)
+    raise ndb.Return(True)
+
+
+def recompute_scores(users, dry_run=False):
+    """Recomputes the Scores of Users and saves those that changed, unless
+    dry_run. Users without finished games keep their Score.
+    Returns:
+        A list of (user name, diff) of the changed Scores, with the number
+        of legacy Score rows removed as legacy_scores, the number of games
+        skipped for lack of History and the names of the users whose Score
+        changed during the run and was not saved"""
+    # Read before the games, so a game that ends meanwhile changes the Score.
+    current = ndb.get_multi([Score.key_for(user.key) for user in users])
+    legacy = [Score.query(Score.user == user.key).fetch_async(keys_only=True) for user in users]
+    futures = [compute_score_async(user) for user in users]
+    changed = []
+    diffs = []
+    skipped = 0
+    for user, future, score, rows in zip(users, futures, current, legacy):
+        computed, user_skipped = future.get_result()
+        skipped += user_skipped
+        if computed is None:
+            continue
+        legacy_keys = [key for key in rows.get_result() if key != computed.key]
+        changes = diff(score, computed)
+        if legacy_keys:
+            changes['legacy_scores'] = (len(legacy_keys), 0)
+        if changes:
+            if score:
+                computed.date = score.date
+            changed.append((user.name, score, computed, legacy_keys))
+            diffs.append((user.name, changes))
+    conflicts = []
+    if not dry_run:
+        saved = [_replace_async(score, computed, legacy_keys) for _, score, computed, legacy_keys in changed]
+        conflicts = [changed[number][0] for number, future in enumerate(saved) if not future.get_result()]
+    return diffs, skipped, conflicts
@@ -0,0 +1,248 @@
+"""tasks.py - Handlers that are called by taskqueue and/or cronjobs, and the
+admin export. They are routed from main.py by name, so this module is only
+imported by instances that serve one of these requests."""
+
+import json
+import logging
+
+import webapp2
+from google.appengine.api import mail, app_identity, taskqueue
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+from google.appengine.api import memcache
+
+from models import Game
+from migrations import merge_scores, rekey_users, move_histories, has_legacy_scores
+import averages
+import counters
+import export
+import leaderboard_cache
+import movelog
+import scoring
+
+
+REMINDER_PAGE_SIZE = 100
+
+
+class SendReminderEmail(webapp2.RequestHandler):
+
+    def get(self):
+        """Send a reminder email to each User with an email about games.
+        Called every 10 hours using a cron job"""
+        self.send_page(None, 0, 0)
+
+    def post(self):
+        """Continue a reminder run from the cursor of a chained task."""
+        cursor = self.request.get('cursor')
+        self.send_page(Cursor(urlsafe=cursor) if cursor else None,
+                       int(self.request.get('users', 0)), int(self.request.get('mails', 0)))
+
+    def send_page(self, cursor, users_scanned, mails_sent):
+        """Send reminders to one page of users with active games and chain a
+        task for the next page. The users are found with a single projection
+        scan over the active games and fetched with one get_multi."""
+        query = Game.query(Game.game_over == False, Game.game_canceled == False)
+        games, next_cursor, more = query.fetch_page(REMINDER_PAGE_SIZE, start_cursor=cursor,
+                                                    projection=[Game.user], distinct=True)
+        users = ndb.get_multi([game.user for game in games])
+
+        app_id = app_identity.get_application_id()
+        for user in users:
+            if user and user.email:
+                subject = 'This is a reminder!'
+                body = 'Hello {}, you have not finish your game yet! play Hangman now!'.format(user.name)
+                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id), user.email, subject, body)
+                mails_sent += 1
+        users_scanned += len(users)
+
+        if more and next_cursor:
+            taskqueue.add(url='/tasks/send_reminder',
+                          params={'cursor': next_cursor.urlsafe(), 'users': users_scanned, 'mails': mails_sent})
+        else:
+            logging.info('Reminder run finished: %d users scanned, %d mails sent', users_scanned, mails_sent)
+
+
+class UpdateAverageMovesRemaining(webapp2.RequestHandler):
+
+    def post(self):
+        """Update game listing announcement in memcache."""
+        averages.cache_average_attempts()
+        stats = memcache.get_multi([averages.MEMCACHE_AVERAGE_ENQUEUED, averages.MEMCACHE_AVERAGE_SUPPRESSED])
+        logging.info('Average moves remaining updated; %d tasks enqueued, %d enqueues suppressed',
+                     stats.get(averages.MEMCACHE_AVERAGE_ENQUEUED, 0),
+                     stats.get(averages.MEMCACHE_AVERAGE_SUPPRESSED, 0))
+        self.response.set_status(204)
+
+
+class FlushMoves(webapp2.RequestHandler):
+
+    def post(self):
+        """Save the logged moves of a game written behind."""
+        movelog.flush(ndb.Key(urlsafe=self.request.get('game')))
+        self.response.set_status(204)
+
+
+class ReconcileActiveGames(webapp2.RequestHandler):
+
+    def get(self):
+        """Rebuild the active games counters from the games and update the
+        average moves remaining. Called every day using a cron job"""
+        games, attempts_remaining = Game.count_active()
+        counters.set_totals(games, attempts_remaining)
+        logging.info('Counted %d active games with %d attempts remaining', games, attempts_remaining)
+        averages.cache_average_attempts()
+
+
+class MergeScores(webapp2.RequestHandler):
+
+    def get(self):
+        """Start merging Score rows into one Score per user."""
+        taskqueue.add(url='/tasks/merge_scores')
+        self.response.write('Merging scores.')
+
+    def post(self):
+        """Merge one page of Score rows and chain a task for the next page."""
+        cursor = self.request.get('cursor')
+        merged, next_cursor = merge_scores(Cursor(urlsafe=cursor) if cursor else None)
+        logging.info('Merged %d Score rows', merged)
+        if next_cursor:
+            taskqueue.add(url='/tasks/merge_scores', params={'cursor': next_cursor.urlsafe()})
+        self.response.set_status(204)
+
+
+class RekeyUsers(webapp2.RequestHandler):
+
+    def get(self):
+        """Start moving Users to keys made from their name."""
+        taskqueue.add(url='/tasks/rekey_users')
+        self.response.write('Moving users.')
+
+    def post(self):
+        """Move one page of Users and chain a task for the next page."""
+        cursor = self.request.get('cursor')
+        moved, next_cursor = rekey_users(Cursor(urlsafe=cursor) if cursor else None)
+        logging.info('Moved %d Users', moved)
+        if next_cursor:
+            taskqueue.add(url='/tasks/rekey_users', params={'cursor': next_cursor.urlsafe()})
+        else:
+            leaderboard_cache.clear()
+        self.response.set_status(204)
+
+
+class MoveHistories(webapp2.RequestHandler):
+
+    def get(self):
+        """Start moving History entries under their Game."""
+        taskqueue.add(url='/tasks/move_histories')
+        self.response.write('Moving histories.')
+
+    def post(self):
+        """Move one page of History entries and chain a task for the next page."""
+        cursor = self.request.get('cursor')
+        moved, next_cursor = move_histories(Cursor(urlsafe=cursor) if cursor else None)
+        logging.info('Moved %d History entries', moved)
+        if next_cursor:
+            taskqueue.add(url='/tasks/move_histories', params={'cursor': next_cursor.urlsafe()})
+        self.response.set_status(204)
+
+
+class ExportEntities(webapp2.RequestHandler):
+
+    def get(self):
+        """Return entities as NDJSON: one chunk, given by chunk and 1 by
+        default, of the finished task export given by export, ending with a
+        next_chunk line if there are more chunks, or one batch of the
+        entities of kind from cursor, ending with a next_cursor line if there
+        are more entities."""
+        self.response.content_type = 'application/x-ndjson'
+        urlsafe = self.request.get('export')
+        if urlsafe:
+            run = ndb.Key(urlsafe=urlsafe).get()
+            if run is None:
+                self.abort(404, 'Export not found')
+            if not run.done:
+                self.abort(409, 'Export is still running, {} chunks stored'.format(run.chunks))
+            try:
+                number = int(self.request.get('chunk', 1))
+            except ValueError:
+                number = 0
+            if not 1 <= number <= max(run.chunks, 1):
+                self.abort(400, 'Invalid chunk')
+            self.response.write(export.get_chunk(run, number))
+            return
+        try:
+            model = export.get_kind(self.request.get('kind'))
+        except ValueError as e:
+            self.abort(400, str(e))
+        cursor = self.request.get('cursor')
+        try:
+            start_cursor = Cursor(urlsafe=cursor) if cursor else None
+        except (datastore_errors.BadValueError, TypeError):
+            self.abort(400, 'Invalid cursor')
+        self.response.write(export.get_batch(model, start_cursor))
+
+
+class ExportChunks(webapp2.RequestHandler):
+
+    def get(self):
+        """Start exporting the kinds given by kind, or every kind, by
+        chained tasks."""
+        kinds = self.request.get_all('kind') or [model._get_kind() for model in export.KINDS]
+        try:
+            key = export.start(kinds)
+        except ValueError as e:
+            self.abort(400, str(e))
+        taskqueue.add(url='/tasks/export', params={'export': key.urlsafe(), 'chunk': 1, 'kind': kinds[0]})
+        self.response.write('Exporting, download from /admin/export?export={} when done.'.format(key.urlsafe()))
+
+    def post(self):
+        """Store one batch of an export and chain a task for the next batch."""
+        key = ndb.Key(urlsafe=self.request.get('export'))
+        number = int(self.request.get('chunk'))
+        cursor = self.request.get('cursor')
+        kind, next_cursor = export.export_batch(key, number, self.request.get('kind'),
+                                                Cursor(urlsafe=cursor) if cursor else None)
+        if kind:
+            taskqueue.add(url='/tasks/export',
+                          params={'export': key.urlsafe(), 'chunk': number + 1, 'kind': kind,
+                                  'cursor': next_cursor.urlsafe() if next_cursor else ''})
+        else:
+            logging.info('Export %s finished with %d chunks', key.urlsafe(), number)
+        self.response.set_status(204)
+
+
+class RecomputeScores(webapp2.RequestHandler):
+
+    def get(self):
+        """Start recomputing every Score from the finished games. With
+        dry_run=1 the differences are only logged. Refused until
+        /tasks/merge_scores has merged the Score rows not keyed by user."""
+        dry_run = self.request.get('dry_run', '')
+        if has_legacy_scores():
+            self.abort(409, 'Run /tasks/merge_scores first, some Scores are not keyed by their user')
+        taskqueue.add(url='/tasks/recompute_scores', params={'dry_run': dry_run})
+        self.response.write('Recomputing scores{}.'.format(' (dry run)' if dry_run else ''))
+
+    def post(self):
+        """Chain a task for the next page of Users, so pages run in parallel,
+        then recompute the Scores of this page and log what changed."""
+        cursor = self.request.get('cursor')
+        dry_run = self.request.get('dry_run', '')
+        users, next_cursor = scoring.fetch_users(Cursor(urlsafe=cursor) if cursor else None)
+        if next_cursor:
+            taskqueue.add(url='/tasks/recompute_scores', params={'cursor': next_cursor.urlsafe(), 'dry_run': dry_run})
+        diffs, skipped, conflicts = scoring.recompute_scores(users, bool(dry_run))
+        for name, changes in diffs:
+            if name in conflicts:
+                logging.warning('Score of %s changed during the run and was not recomputed: %s', name,
+                                json.dumps(changes, sort_keys=True))
+            else:
+                logging.info('Score of %s %s: %s', name, 'differs' if dry_run else 'recomputed',
+                             json.dumps(changes, sort_keys=True))
+        logging.info('Recomputed Scores of %d users: %d changed, %d changed during the run, '
+                     '%d games without history skipped', len(users), len(diffs) - len(conflicts),
+                     len(conflicts), skipped)
+        if diffs and not dry_run:
+            leaderboard_cache.clear()
+        self.response.set_status(204)
@@ -0,0 +1,82 @@
+"""bench_imports.py - Measures the startup cost of the app modules.
+
+Every measurement runs in a fresh Python process, so nothing is imported or
+loaded already: first the module is imported, then the word pool, difficulty
+index and attempt budgets are loaded as the warmup handler does. Reports the
+median of --repeat runs in milliseconds.
+
+    python tools/bench_imports.py --sdk ~/google_appengine
+    python tools/bench_imports.py --json startup.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import local
+
+# The modules an instance imports to serve each kind of request.
+MODULES = ('main', 'tasks', 'models', 'api')
+
+_CHILD = '''
+import sys, timeit
+sys.path.insert(0, {tools!r})
+import local
+local.add_sdk_to_path({sdk!r})
+start = timeit.default_timer()
+import {module}
+imported = timeit.default_timer()
+from random_words import get_word_pool
+from difficulty import get_word_index
+from budgets import get_budgets
+get_word_pool()
+pool = timeit.default_timer()
+get_word_index()
+index = timeit.default_timer()
+get_budgets()
+budgets = timeit.default_timer()
+print('%f %f %f %f' % (imported - start, pool - imported, index - pool, budgets - index))
+'''
+
+
+def measure(module, sdk_path):
+    """Returns the seconds taken to import module, load the word pool, build
+    the difficulty index and load the budgets in a fresh process"""
+    code = _CHILD.format(tools=os.path.dirname(os.path.abspath(__file__)), sdk=sdk_path, module=module)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=local.ROOT)
+    return [float(value) for value in output.split()]
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sdk', help='Path of the App Engine SDK')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--module', action='append', help='Module to import, may be repeated. Default: ' +
+                        ', '.join(MODULES))
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    # Checks the SDK once here rather than failing in every child process.
+    sdk_path = local.add_sdk_to_path(args.sdk)
+    results = {}
+    print('{:<10} {:>10} {:>10} {:>10} {:>10}'.format('module', 'import', 'word pool', 'index', 'budgets'))
+    for module in args.module or MODULES:
+        runs = [measure(module, sdk_path) for _ in range(args.repeat)]
+        medians = [_median(column) * 1000 for column in zip(*runs)]
+        results[module] = dict(zip(('import_ms', 'word_pool_ms', 'index_ms', 'budgets_ms'), medians))
+        print('{:<10} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(module, *medians))
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'args': vars(args), 'results': results}, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,176 @@
+"""loadtest.py - Benchmark of the Hangman endpoints on local service stubs.
+
+Simulated players create users, play games through new_game and make_move and
+read the score endpoints after each game. The run is seeded, so the same
+arguments replay the same requests. Reports throughput, p50/p99 latency and
+the datastore and memcache calls per request of every endpoint.
+
+    python tools/loadtest.py --sdk ~/google_appengine
+    python tools/loadtest.py --players 50 --games 10 --json before.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import local
+
+# Letters in the order of their frequency in English words.
+LETTER_FREQUENCY = 'eaisrntolcdupmghbyfvkwzxjq'
+
+# Each scenario sets these environment variables for its run.
+SCENARIOS = {
+    'default': {'WRITE_BEHIND_MOVES': 'false'},
+    'write_behind': {'WRITE_BEHIND_MOVES': 'true'},
+}
+
+
+class Recorder(object):
+    """Calls endpoints and records their latency and API calls"""
+
+    def __init__(self, services, api):
+        self.services = services
+        self.api = api
+        self.latencies = defaultdict(list)
+        self.calls = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+
+    def call(self, name, **fields):
+        """Calls the endpoint method name with a request of fields.
+        Returns:
+            The response, or None if the endpoint raised an error"""
+        from protorpc import remote
+        method = getattr(self.api, name)
+        request = method.remote.request_type(**fields)
+        self.services.new_request()
+        self.services.reset_calls()
+        start = timeit.default_timer()
+        try:
+            response = method(request)
+        except remote.ApplicationError:
+            response = None
+            self.errors[name] += 1
+        self.latencies[name].append(timeit.default_timer() - start)
+        for (service, call), count in self.services.reset_calls().items():
+            self.calls[name][service] += count
+        return response
+
+    def report(self, elapsed):
+        """Returns the results of every endpoint, keyed by name"""
+        results = {}
+        for name, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            requests = len(latencies)
+            results[name] = {
+                'requests': requests,
+                'errors': self.errors[name],
+                'per_second': requests / elapsed if elapsed else 0,
+                'p50_ms': _percentile(latencies, 50) * 1000,
+                'p99_ms': _percentile(latencies, 99) * 1000,
+                'datastore_per_request': self.calls[name]['datastore_v3'] / float(requests),
+                'memcache_per_request': self.calls[name]['memcache'] / float(requests),
+            }
+        return results
+
+
+def _percentile(values, percent):
+    """Returns the nearest-rank percentile of sorted values"""
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def play(recorder, rng, user_name, games, miss_rate):
+    """Plays games as one user, guessing letters mostly by frequency"""
+    for _ in range(games):
+        game = recorder.call('new_game', user_name=user_name)
+        if game is None:
+            return
+        letters = list(LETTER_FREQUENCY)
+        while not game.game_over:
+            if rng.random() < miss_rate:
+                guess = letters.pop(rng.randrange(len(letters)))
+            else:
+                guess = letters.pop(0)
+            moved = recorder.call('make_move', urlsafe_game_key=game.urlsafe_key, guess=guess)
+            if moved is not None:
+                game = moved
+        recorder.call('get_user_score', user_name=user_name)
+        recorder.call('get_high_scores')
+        recorder.call('get_user_rankings', limit=10)
+    recorder.call('get_user_games', user_name=user_name, limit=10)
+    recorder.call('get_scores', limit=10)
+
+
+def run(scenario, args):
+    """Runs one scenario on fresh local services.
+    Returns:
+        The results of every endpoint and the totals of the run"""
+    os.environ.update(SCENARIOS[scenario])
+    services = local.LocalServices()
+    try:
+        from api import HangmanApi
+        from main import app
+
+        recorder = Recorder(services, HangmanApi())
+        rng = random.Random(args.seed)
+        players = ['player{}'.format(number) for number in range(args.players)]
+        tasks = 0
+        start = timeit.default_timer()
+        for name in players:
+            recorder.call('create_user', user_name=name, email='{}@example.com'.format(name))
+        # Players take turns a game at a time, so their games interleave.
+        for _ in range(args.games):
+            for name in players:
+                play(recorder, rng, name, 1, args.miss_rate)
+            tasks += services.run_tasks(app)
+        elapsed = timeit.default_timer() - start
+        endpoints = recorder.report(elapsed)
+        requests = sum(result['requests'] for result in endpoints.values())
+        return {'endpoints': endpoints,
+                'total': {'requests': requests, 'seconds': elapsed, 'per_second': requests / elapsed,
+                          'tasks': tasks}}
+    finally:
+        services.deactivate()
+
+
+def print_results(scenario, results):
+    print('\n{} ({requests} requests in {seconds:.2f}s, {per_second:.1f}/s, {tasks} tasks)'.format(
+        scenario, **results['total']))
+    print('{:<20} {:>8} {:>7} {:>9} {:>9} {:>9} {:>10} {:>10}'.format(
+        'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms', 'datastore', 'memcache'))
+    for name, result in sorted(results['endpoints'].items()):
+        print('{:<20} {requests:>8} {errors:>7} {per_second:>9.1f} {p50_ms:>9.2f} {p99_ms:>9.2f} '
+              '{datastore_per_request:>10.2f} {memcache_per_request:>10.2f}'.format(name, **result))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sdk', help='Path of the App Engine SDK')
+    parser.add_argument('--players', type=int, default=20)
+    parser.add_argument('--games', type=int, default=5, help='Games played by each player')
+    parser.add_argument('--miss-rate', type=float, default=0.3,
+                        help='Chance of guessing a random letter instead of the next most frequent one')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='Scenario to run, may be repeated. Runs all by default')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+
+    local.add_sdk_to_path(args.sdk)
+    results = {}
+    for scenario in args.scenario or sorted(SCENARIOS):
+        results[scenario] = run(scenario, args)
+        print_results(scenario, results[scenario])
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'args': vars(args), 'results': results}, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
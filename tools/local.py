@@ -0,0 +1,100 @@
+"""local.py - Runs the app outside App Engine on the SDK's in-memory service
+stubs, for the benchmarks in this directory.
+
+The datastore, memcache and task queue are the SDK's own local stubs, set up
+with testbed, so the app code runs unchanged. Every API call is counted by
+service and method, and queued tasks are run on demand against the handlers
+in main.py."""
+
+import os
+import sys
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def add_sdk_to_path(sdk_path=None):
+    """Puts the App Engine SDK, its bundled libraries and the app on
+    sys.path. sdk_path defaults to the APPENGINE_SDK environment variable or
+    the SDK next to the gcloud command.
+    Returns:
+        The path of the SDK"""
+    sdk_path = sdk_path or os.environ.get('APPENGINE_SDK')
+    if not sdk_path:
+        for directory in os.environ.get('PATH', '').split(os.pathsep):
+            candidate = os.path.join(os.path.dirname(directory), 'platform', 'google_appengine')
+            if os.path.exists(os.path.join(directory, 'gcloud')) and os.path.isdir(candidate):
+                sdk_path = candidate
+                break
+    if not sdk_path:
+        sys.exit('App Engine SDK not found, pass --sdk or set APPENGINE_SDK')
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path[1:1] = [ROOT, os.path.join(ROOT, 'libs')]
+    return sdk_path
+
+
+class LocalServices(object):
+    """Activates the local service stubs and counts the API calls made"""
+
+    def __init__(self):
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import testbed
+
+        self.calls = Counter()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.setup_env(app_id='hangman-local', overwrite=True)
+        # Queries see every write at once, like the ancestor and key reads
+        # the app depends on, so runs are repeatable.
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_mail_stub()
+        self.testbed.init_app_identity_stub()
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+
+        from google.appengine.api import apiproxy_stub_map
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('local_services', self._count)
+
+    def _count(self, service, call, request, response):
+        self.calls[service, call] += 1
+
+    def reset_calls(self):
+        """Returns the API calls counted since the last reset"""
+        calls = self.calls
+        self.calls = Counter()
+        return calls
+
+    def new_request(self):
+        """Starts a request with an empty ndb context cache, as App Engine
+        does for every request"""
+        from google.appengine.ext import ndb
+        ndb.get_context().clear_cache()
+
+    def run_tasks(self, app, queue_name='default'):
+        """Runs the queued tasks, and the tasks they enqueue, against a
+        WSGI app. Countdowns are ignored.
+        Returns:
+            The number of tasks run"""
+        import webapp2
+        count = 0
+        while True:
+            tasks = self.taskqueue.get_filtered_tasks(queue_names=[queue_name])
+            if not tasks:
+                return count
+            self.taskqueue.FlushQueue(queue_name)
+            for task in tasks:
+                self.new_request()
+                request = webapp2.Request.blank(task.url, method=task.method, body=task.payload or '')
+                request.headers['Content-Type'] = 'application/x-www-form-urlencoded'
+                request.headers['X-AppEngine-TaskName'] = task.name
+                response = request.get_response(app)
+                if response.status_int >= 400:
+                    raise RuntimeError('Task {} failed with {}'.format(task.url, response.status))
+                count += 1
+
+    def deactivate(self):
+        self.testbed.deactivate()
@@ -0,0 +1,179 @@
+"""simulate.py - Plays simulated games over the noun corpus to calibrate the
+attempts allowed for every target word.
+
+A letter-frequency solver guesses the letter found in most of the words that
+still match the revealed progress, and sometimes, with --explore, a letter
+drawn by how many of those words contain it, so repeated games of a word
+differ the way players do. The corpus is encoded as NumPy arrays grouped by
+word length, so filtering the candidates after a guess is a few array
+operations, and the words are split across a process pool.
+
+For every word the mean guesses and misses, the 90th percentile and most
+misses and the budget are written to attempt_budgets.bin, which Game.new_game
+reads. The budget is the fewest attempts that let the solver win --win-rate
+of its games, since a game is lost on the miss that uses up the last attempt,
+plus --extra attempts for players who do not know the whole corpus. The
+solver narrows its guesses down with the whole corpus, which no player
+knows, so no budget is below half the distinct letters of the word plus
+--extra. The distribution of the budgets is printed before the file is
+written, and --dry-run only prints it.
+
+Requires NumPy, which is only needed here and not by the app.
+
+    python tools/simulate.py --games 200
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[0:0] = [ROOT, os.path.join(ROOT, 'libs')]
+
+import budgets
+from random_words import get_word_pool
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+# Code of characters that are not letters; they are never guessed.
+OTHER = len(LETTERS)
+
+_groups = None
+
+
+def encode(words):
+    """Returns dict of length -> (codes, presence) for the words of that
+    length: codes has a row of letter codes per word and presence a row of
+    the letter codes each word contains"""
+    by_length = {}
+    for word in words:
+        by_length.setdefault(len(word), []).append(word)
+    groups = {}
+    for length, group in by_length.items():
+        codes = np.full((len(group), length), OTHER, dtype=np.uint8)
+        for row, word in enumerate(group):
+            for column, letter in enumerate(word.lower()):
+                if letter in LETTERS:
+                    codes[row, column] = LETTERS.index(letter)
+        presence = np.zeros((len(group), OTHER + 1), dtype=bool)
+        np.put_along_axis(presence, codes.astype(np.intp), True, axis=1)
+        groups[length] = (codes, presence)
+    return groups
+
+
+def play(codes, presence, target, rng, explore):
+    """Plays one game of the word at row target of its length group.
+    Returns:
+        The number of guesses and of misses until the word was revealed"""
+    word = codes[target]
+    candidates = np.ones(len(codes), dtype=bool)
+    guessed = np.zeros(OTHER + 1, dtype=bool)
+    guessed[OTHER] = True
+    revealed = word == OTHER
+    guesses = misses = 0
+    while not revealed.all():
+        counts = presence[candidates].sum(axis=0)
+        counts[guessed] = 0
+        if explore and rng.random_sample() < explore:
+            letter = rng.choice(len(counts), p=counts / float(counts.sum()))
+        else:
+            letter = counts.argmax()
+        guessed[letter] = True
+        guesses += 1
+        hits = word == letter
+        if hits.any():
+            revealed |= hits
+            candidates &= ((codes == letter) == hits).all(axis=1)
+        else:
+            misses += 1
+            candidates &= ~presence[:, letter]
+    return guesses, misses
+
+
+def _start_worker(words):
+    global _groups
+    _groups = encode(words)
+
+
+def simulate_words(task):
+    """Plays games of a chunk of words in a worker.
+    Args:
+        task: (seed, games, explore, win_rate, extra, [(length, row), ...])
+    Returns:
+        A stats record per word"""
+    seed, games, explore, win_rate, extra, positions = task
+    rng = np.random.RandomState(seed)
+    records = []
+    for length, row in positions:
+        codes, presence = _groups[length]
+        results = np.array([play(codes, presence, row, rng, explore) for _ in range(games)])
+        misses = np.sort(results[:, 1])
+        # Winning needs one attempt more than the misses of the game.
+        budget = int(misses[min(len(misses) - 1, int(np.ceil(win_rate * len(misses))) - 1)]) + 1 + extra
+        budget = max(budget, int(presence[row, :OTHER].sum()) // 2 + extra)
+        records.append((results[:, 0].mean(), misses.mean(), int(np.percentile(misses, 90)),
+                        int(misses[-1]), budget))
+    return records
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--games', type=int, default=200, help='Games played per word')
+    parser.add_argument('--explore', type=float, default=0.2,
+                        help='Chance of a guess drawn by letter frequency instead of the most frequent letter')
+    parser.add_argument('--win-rate', type=float, default=0.9,
+                        help='Share of the games of a word its budget lets the solver win')
+    parser.add_argument('--extra', type=int, default=3, help='Attempts added to the budget of the solver')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--chunk', type=int, default=50, help='Words per task')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=budgets.BUDGETS_FILE)
+    parser.add_argument('--dry-run', action='store_true', help='Print the budgets without writing the file')
+    args = parser.parse_args(argv)
+
+    words = list(get_word_pool().words)
+    rows = {}
+    positions = []
+    for word in words:
+        rows[len(word)] = rows.get(len(word), -1) + 1
+        positions.append((len(word), rows[len(word)]))
+    tasks = [(args.seed + number, args.games, args.explore, args.win_rate, args.extra,
+              positions[start:start + args.chunk])
+             for number, start in enumerate(range(0, len(positions), args.chunk))]
+
+    start = time.time()
+    pool = multiprocessing.Pool(args.processes, _start_worker, (words,))
+    try:
+        records = [record for chunk in pool.imap(simulate_words, tasks) for record in chunk]
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+
+    played = len(words) * args.games
+    print('Played {} games of {} words in {:.1f}s ({:.0f} games/s)'.format(played, len(words), elapsed,
+                                                                       played / elapsed))
+    print_distribution(words, records)
+    if not args.dry_run:
+        with open(args.output, 'wb') as output:
+            output.write(budgets.dumps(words, records))
+        print('Written to {}'.format(args.output))
+
+
+def print_distribution(words, records):
+    """Prints how the budgets compare with one attempt per letter, and how
+    many words get each difference"""
+    differences = np.array([record[4] - len(word) for word, record in zip(words, records)])
+    print('Mean budget {:.2f}, {} words get fewer attempts than letters, {} the same, {} more'.format(
+        sum(record[4] for record in records) / float(len(records)), (differences < 0).sum(),
+        (differences == 0).sum(), (differences > 0).sum()))
+    print('{:>12} {:>8}'.format('difference', 'words'))
+    for difference, count in zip(*np.unique(differences, return_counts=True)):
+        print('{:>+12d} {:>8d}'.format(int(difference), int(count)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
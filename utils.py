@@ -1,9 +1,17 @@
 """utils.py - File for collecting general utility functions."""
 
 
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 import endpoints
 
+import game_cache
+import movelog
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
 
 def get_by_urlsafe(urlsafe, model):
     """Returns an ndb.Model entity that the urlsafe key points to. Checks
@@ -18,8 +26,24 @@ def get_by_urlsafe(urlsafe, model):
         exists.
     Raises:
         ValueError:"""
+    key = key_from_urlsafe(urlsafe)
+    if key.kind() == game_cache.KIND:
+        entity = game_cache.get(key, movelog.load)
+    else:
+        entity = key.get()
+    if not entity:
+        return None
+    if not isinstance(entity, model):
+        raise ValueError('Incorrect Kind')
+    return entity
+
+
+def key_from_urlsafe(urlsafe):
+    """Returns the ndb.Key of a urlsafe key string
+    Raises:
+        endpoints.BadRequestException: if the key string is malformed"""
     try:
-        key = ndb.Key(urlsafe=urlsafe)
+        return ndb.Key(urlsafe=urlsafe)
     except TypeError:
         raise endpoints.BadRequestException('Invalid Key')
     except Exception, e:
@@ -28,9 +52,34 @@ def get_by_urlsafe(urlsafe, model):
         else:
             raise
 
-    entity = key.get()
-    if not entity:
-        return None
-    if not isinstance(entity, model):
-        raise ValueError('Incorrect Kind')
-    return entity
+
+def page_size(limit):
+    """Returns the number of results per page for a requested limit.
+    Raises:
+        endpoints.BadRequestException: for a limit below 1"""
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    if limit < 1:
+        raise endpoints.BadRequestException('limit must be greater than 0')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def fetch_page(query, limit, cursor):
+    """Returns one page of query results.
+    Args:
+        query: The ndb.Query
+        limit: The requested number of results or None for the default
+        cursor: The urlsafe cursor of the page or None for the first page
+    Returns:
+        The results and the urlsafe cursor of the next page or None for the
+        last page
+    Raises:
+        endpoints.BadRequestException: for an invalid limit or cursor"""
+    limit = page_size(limit)
+    try:
+        start_cursor = Cursor(urlsafe=cursor) if cursor else None
+    except (datastore_errors.BadValueError, TypeError):
+        raise endpoints.BadRequestException('Invalid cursor')
+    results, next_cursor, more = query.fetch_page(limit, start_cursor=start_cursor)
+    return results, next_cursor.urlsafe() if more and next_cursor else None
+